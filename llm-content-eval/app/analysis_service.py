@@ -1,87 +1,159 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, or_, case, select, lambda_stmt
 from app.models import Generation, Evaluation, Experiment, Task, ModelProvider, PromptStrategy
+from app.experiment_cache import ExperimentCache
 from app.schemas import AnalysisSummary, ModelAnalysis, StrategyAnalysis, TaskAnalysis
 import csv
+import functools
 import io
 
+# Rows fetched from the database and written per CSV chunk during export
+EXPORT_BATCH_SIZE = 1000
+
+# Maximum number of (method, experiment) results kept in the analysis cache,
+# and how long each stays valid. The TTL bounds staleness from writes the
+# ORM events below cannot see, such as other worker processes.
+ANALYSIS_CACHE_SIZE = 256
+ANALYSIS_CACHE_TTL_SECONDS = 60
+
+# Analysis results per experiment, keyed by method name
+_analysis_cache = ExperimentCache(
+    "analysis", ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL_SECONDS,
+    models=(Generation, Evaluation),
+    events=("after_insert", "after_update", "after_delete")
+)
+invalidate_analysis_cache = _analysis_cache.invalidate
+
+# Marks a result missing from the cache, since None is a valid result
+_MISSING = object()
+
+def _cached_per_experiment(method):
+    """Cache an analysis method per experiment until its data changes"""
+    
+    @functools.wraps(method)
+    def wrapper(self, db: Session, experiment_id: int):
+        result = _analysis_cache.get(experiment_id, method.__name__, _MISSING)
+        if result is _MISSING:
+            result = method(self, db, experiment_id)
+            _analysis_cache.set(experiment_id, result, method.__name__)
+        return result
+    
+    return wrapper
+
+def _quality_extremes_stmt(experiment_id: int):
+    """Evaluations ranked first by overall quality, descending and ascending"""
+    ranked = select(
+        Evaluation.task_id,
+        Evaluation.model_provider,
+        Evaluation.model_name,
+        Evaluation.prompt_strategy,
+        Evaluation.overall_quality,
+        func.row_number().over(
+            order_by=(Evaluation.overall_quality.desc(), Evaluation.id)
+        ).label("rank_desc"),
+        func.row_number().over(
+            order_by=(Evaluation.overall_quality.asc(), Evaluation.id)
+        ).label("rank_asc")
+    ).where(Evaluation.experiment_id == experiment_id).subquery()
+    
+    return select(ranked).where(
+        or_(ranked.c.rank_desc == 1, ranked.c.rank_asc == 1)
+    )
+
+def _best_per_task_stmt(experiment_id: int):
+    """Per-task score averages alongside each task's best-scoring evaluation"""
+    task_window = {"partition_by": Evaluation.task_id}
+    ranked = select(
+        Evaluation.task_id,
+        Evaluation.model_provider,
+        Evaluation.model_name,
+        Evaluation.prompt_strategy,
+        func.avg(Evaluation.voice_match).over(**task_window).label("voice_match"),
+        func.avg(Evaluation.coherence).over(**task_window).label("coherence"),
+        func.avg(Evaluation.engaging).over(**task_window).label("engaging"),
+        func.avg(Evaluation.meets_brief).over(**task_window).label("meets_brief"),
+        func.avg(Evaluation.overall_quality).over(**task_window).label("overall_quality"),
+        func.count(Evaluation.id).over(**task_window).label("evaluation_count"),
+        func.row_number().over(
+            partition_by=Evaluation.task_id,
+            order_by=(Evaluation.overall_quality.desc(), Evaluation.id)
+        ).label("rank")
+    ).where(Evaluation.experiment_id == experiment_id).subquery()
+    
+    return select(
+        Task.id,
+        Task.title,
+        Task.content_type,
+        ranked
+    ).join(
+        ranked, ranked.c.task_id == Task.id
+    ).where(
+        ranked.c.rank == 1
+    ).order_by(Task.id)
+
 class AnalysisService:
     
+    @_cached_per_experiment
     def get_summary(self, db: Session, experiment_id: int) -> AnalysisSummary:
         """Get summary statistics for an experiment"""
         
         # Get experiment
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+        experiment = db.execute(lambda_stmt(
+            lambda: select(Experiment.id).where(Experiment.id == experiment_id)
+        )).first()
         if not experiment:
             raise ValueError(f"Experiment {experiment_id} not found")
         
-        # Count generations and evaluations
-        total_generations = db.query(Generation).filter(
-            Generation.experiment_id == experiment_id
-        ).count()
-        
-        total_evaluations = db.query(Evaluation).filter(
-            Evaluation.experiment_id == experiment_id
-        ).count()
-        
-        # Calculate average scores
-        avg_scores = db.query(
+        # Evaluation count and average scores in a single aggregate
+        eval_stats = db.execute(lambda_stmt(lambda: select(
+            func.count(Evaluation.id).label("total_evaluations"),
             func.avg(Evaluation.voice_match).label("voice_match"),
             func.avg(Evaluation.coherence).label("coherence"),
             func.avg(Evaluation.engaging).label("engaging"),
             func.avg(Evaluation.meets_brief).label("meets_brief"),
             func.avg(Evaluation.overall_quality).label("overall_quality")
-        ).filter(Evaluation.experiment_id == experiment_id).first()
+        ).where(Evaluation.experiment_id == experiment_id))).one()
         
-        # Find best and worst combinations based on overall quality
-        best_eval = db.query(Evaluation).filter(
-            Evaluation.experiment_id == experiment_id
-        ).order_by(Evaluation.overall_quality.desc()).first()
-        
-        worst_eval = db.query(Evaluation).filter(
-            Evaluation.experiment_id == experiment_id
-        ).order_by(Evaluation.overall_quality.asc()).first()
-        
-        # Calculate total cost and average latency
-        generation_stats = db.query(
+        # Generation count, total cost and average latency in a single aggregate
+        generation_stats = db.execute(lambda_stmt(lambda: select(
+            func.count(Generation.id).label("total_generations"),
             func.sum(Generation.cost_usd).label("total_cost"),
             func.avg(Generation.latency_ms).label("avg_latency")
-        ).filter(Generation.experiment_id == experiment_id).first()
+        ).where(Generation.experiment_id == experiment_id))).one()
+        
+        # Rank evaluations by overall quality in both directions so the best
+        # and worst combinations come back from a single query
+        extremes = db.execute(lambda_stmt(
+            lambda: _quality_extremes_stmt(experiment_id)
+        )).all()
         
         best_combination = {}
         worst_combination = {}
         
-        if best_eval:
-            best_gen = best_eval.generation
-            best_combination = {
-                "model_provider": best_gen.model_provider.value,
-                "model_name": best_gen.model_name,
-                "prompt_strategy": best_gen.prompt_strategy.value,
-                "task_id": best_gen.task_id,
-                "overall_quality": best_eval.overall_quality
-            }
-        
-        if worst_eval:
-            worst_gen = worst_eval.generation
-            worst_combination = {
-                "model_provider": worst_gen.model_provider.value,
-                "model_name": worst_gen.model_name,
-                "prompt_strategy": worst_gen.prompt_strategy.value,
-                "task_id": worst_gen.task_id,
-                "overall_quality": worst_eval.overall_quality
+        for row in extremes:
+            combination = {
+                "model_provider": row.model_provider.value,
+                "model_name": row.model_name,
+                "prompt_strategy": row.prompt_strategy.value,
+                "task_id": row.task_id,
+                "overall_quality": row.overall_quality
             }
+            if row.rank_desc == 1:
+                best_combination = combination
+            if row.rank_asc == 1:
+                worst_combination = combination
         
         return AnalysisSummary(
             experiment_id=experiment_id,
-            total_generations=total_generations,
-            total_evaluations=total_evaluations,
+            total_generations=generation_stats.total_generations,
+            total_evaluations=eval_stats.total_evaluations,
             avg_scores={
-                "voice_match": round(avg_scores.voice_match, 2) if avg_scores.voice_match else 0,
-                "coherence": round(avg_scores.coherence, 2) if avg_scores.coherence else 0,
-                "engaging": round(avg_scores.engaging, 2) if avg_scores.engaging else 0,
-                "meets_brief": round(avg_scores.meets_brief, 2) if avg_scores.meets_brief else 0,
-                "overall_quality": round(avg_scores.overall_quality, 2) if avg_scores.overall_quality else 0
+                "voice_match": round(eval_stats.voice_match, 2) if eval_stats.voice_match else 0,
+                "coherence": round(eval_stats.coherence, 2) if eval_stats.coherence else 0,
+                "engaging": round(eval_stats.engaging, 2) if eval_stats.engaging else 0,
+                "meets_brief": round(eval_stats.meets_brief, 2) if eval_stats.meets_brief else 0,
+                "overall_quality": round(eval_stats.overall_quality, 2) if eval_stats.overall_quality else 0
             },
             best_combination=best_combination,
             worst_combination=worst_combination,
@@ -89,65 +161,57 @@ class AnalysisService:
             avg_latency_ms=round(generation_stats.avg_latency, 2) if generation_stats.avg_latency else 0
         )
     
+    @_cached_per_experiment
     def analyze_by_model(self, db: Session, experiment_id: int) -> List[ModelAnalysis]:
         """Analyze results grouped by model"""
         
-        # Get all unique model combinations
-        model_combinations = db.query(
+        # Aggregate scores and generation stats per model in one query. The
+        # outer join keeps cost/latency averaged over every generation of the
+        # model, evaluated or not; score averages skip the NULL rows.
+        rows = db.execute(lambda_stmt(lambda: select(
             Generation.model_provider,
-            Generation.model_name
-        ).filter(
+            Generation.model_name,
+            func.avg(Evaluation.voice_match).label("voice_match"),
+            func.avg(Evaluation.coherence).label("coherence"),
+            func.avg(Evaluation.engaging).label("engaging"),
+            func.avg(Evaluation.meets_brief).label("meets_brief"),
+            func.avg(Evaluation.overall_quality).label("overall_quality"),
+            func.count(Evaluation.id).label("evaluation_count"),
+            func.sum(
+                case((Evaluation.would_publish.in_(["yes", "with_edits"]), 1), else_=0)
+            ).label("would_publish_count"),
+            func.avg(Generation.cost_usd).label("avg_cost"),
+            func.avg(Generation.latency_ms).label("avg_latency")
+        ).outerjoin(
+            Evaluation, Evaluation.generation_id == Generation.id
+        ).where(
             Generation.experiment_id == experiment_id
-        ).distinct().all()
+        ).group_by(
+            Generation.model_provider,
+            Generation.model_name
+        ).having(
+            func.count(Evaluation.id) > 0
+        ))).all()
         
         results = []
         
-        for provider, model_name in model_combinations:
-            # Get evaluations for this model
-            evaluations = db.query(Evaluation).join(Generation).filter(
-                and_(
-                    Generation.experiment_id == experiment_id,
-                    Generation.model_provider == provider,
-                    Generation.model_name == model_name
-                )
-            ).all()
-            
-            if not evaluations:
-                continue
-            
-            # Calculate average scores
+        for row in rows:
             avg_scores = {
-                "voice_match": sum(e.voice_match for e in evaluations) / len(evaluations),
-                "coherence": sum(e.coherence for e in evaluations) / len(evaluations),
-                "engaging": sum(e.engaging for e in evaluations) / len(evaluations),
-                "meets_brief": sum(e.meets_brief for e in evaluations) / len(evaluations),
-                "overall_quality": sum(e.overall_quality for e in evaluations) / len(evaluations)
+                "voice_match": row.voice_match,
+                "coherence": row.coherence,
+                "engaging": row.engaging,
+                "meets_brief": row.meets_brief,
+                "overall_quality": row.overall_quality
             }
             
-            # Calculate would_publish rate
-            would_publish_count = sum(1 for e in evaluations if e.would_publish in ["yes", "with_edits"])
-            would_publish_rate = would_publish_count / len(evaluations) if evaluations else 0
-            
-            # Get generation stats
-            generation_stats = db.query(
-                func.avg(Generation.cost_usd).label("avg_cost"),
-                func.avg(Generation.latency_ms).label("avg_latency")
-            ).filter(
-                and_(
-                    Generation.experiment_id == experiment_id,
-                    Generation.model_provider == provider,
-                    Generation.model_name == model_name
-                )
-            ).first()
-            
             results.append(ModelAnalysis(
-                model_provider=provider.value,
-                model_name=model_name,
+                model_provider=row.model_provider.value,
+                model_name=row.model_name,
                 avg_scores={k: round(v, 2) for k, v in avg_scores.items()},
-                evaluation_count=len(evaluations),
-                avg_cost=round(generation_stats.avg_cost, 4) if generation_stats.avg_cost else 0,
-                avg_latency_ms=round(generation_stats.avg_latency, 2) if generation_stats.avg_latency else 0,
-                would_publish_rate=round(would_publish_rate, 2)
+                evaluation_count=row.evaluation_count,
+                avg_cost=round(row.avg_cost, 4) if row.avg_cost else 0,
+                avg_latency_ms=round(row.avg_latency, 2) if row.avg_latency else 0,
+                would_publish_rate=round(row.would_publish_count / row.evaluation_count, 2)
             ))
         
         # Sort by overall quality
@@ -155,100 +219,125 @@ class AnalysisService:
         
         return results
     
+    @_cached_per_experiment
     def analyze_by_strategy(self, db: Session, experiment_id: int) -> List[StrategyAnalysis]:
         """Analyze results grouped by prompting strategy"""
         
+        # Aggregate scores per strategy in one query over evaluations alone
+        rows = db.execute(lambda_stmt(lambda: select(
+            Evaluation.prompt_strategy,
+            func.avg(Evaluation.voice_match).label("voice_match"),
+            func.avg(Evaluation.coherence).label("coherence"),
+            func.avg(Evaluation.engaging).label("engaging"),
+            func.avg(Evaluation.meets_brief).label("meets_brief"),
+            func.avg(Evaluation.overall_quality).label("overall_quality"),
+            func.count(Evaluation.id).label("evaluation_count"),
+            func.sum(
+                case((Evaluation.would_publish.in_(["yes", "with_edits"]), 1), else_=0)
+            ).label("would_publish_count")
+        ).where(
+            Evaluation.experiment_id == experiment_id
+        ).group_by(
+            Evaluation.prompt_strategy
+        ))).all()
+        
+        rows_by_strategy = {row.prompt_strategy: row for row in rows}
         results = []
         
         for strategy in [PromptStrategy.STRUCTURED, PromptStrategy.EXAMPLE_BASED]:
-            # Get evaluations for this strategy
-            evaluations = db.query(Evaluation).join(Generation).filter(
-                and_(
-                    Generation.experiment_id == experiment_id,
-                    Generation.prompt_strategy == strategy
-                )
-            ).all()
-            
-            if not evaluations:
+            row = rows_by_strategy.get(strategy)
+            if not row:
                 continue
             
-            # Calculate average scores
             avg_scores = {
-                "voice_match": sum(e.voice_match for e in evaluations) / len(evaluations),
-                "coherence": sum(e.coherence for e in evaluations) / len(evaluations),
-                "engaging": sum(e.engaging for e in evaluations) / len(evaluations),
-                "meets_brief": sum(e.meets_brief for e in evaluations) / len(evaluations),
-                "overall_quality": sum(e.overall_quality for e in evaluations) / len(evaluations)
+                "voice_match": row.voice_match,
+                "coherence": row.coherence,
+                "engaging": row.engaging,
+                "meets_brief": row.meets_brief,
+                "overall_quality": row.overall_quality
             }
             
-            # Calculate would_publish rate
-            would_publish_count = sum(1 for e in evaluations if e.would_publish in ["yes", "with_edits"])
-            would_publish_rate = would_publish_count / len(evaluations) if evaluations else 0
-            
             results.append(StrategyAnalysis(
                 strategy=strategy.value,
                 avg_scores={k: round(v, 2) for k, v in avg_scores.items()},
-                evaluation_count=len(evaluations),
-                would_publish_rate=round(would_publish_rate, 2)
+                evaluation_count=row.evaluation_count,
+                would_publish_rate=round(row.would_publish_count / row.evaluation_count, 2)
             ))
         
         return results
     
+    @_cached_per_experiment
     def analyze_by_task(self, db: Session, experiment_id: int) -> List[TaskAnalysis]:
         """Analyze results grouped by task"""
         
-        # Get all tasks
-        tasks = db.query(Task).all()
+        # Per-task averages as window aggregates, keeping the row of each
+        # task that carries its best-scoring model and strategy
+        rows = db.execute(lambda_stmt(
+            lambda: _best_per_task_stmt(experiment_id)
+        )).all()
+        
         results = []
         
-        for task in tasks:
-            # Get evaluations for this task
-            evaluations = db.query(Evaluation).join(Generation).filter(
-                and_(
-                    Generation.experiment_id == experiment_id,
-                    Generation.task_id == task.id
-                )
-            ).all()
-            
-            if not evaluations:
-                continue
-            
-            # Calculate average scores
+        for row in rows:
             avg_scores = {
-                "voice_match": sum(e.voice_match for e in evaluations) / len(evaluations),
-                "coherence": sum(e.coherence for e in evaluations) / len(evaluations),
-                "engaging": sum(e.engaging for e in evaluations) / len(evaluations),
-                "meets_brief": sum(e.meets_brief for e in evaluations) / len(evaluations),
-                "overall_quality": sum(e.overall_quality for e in evaluations) / len(evaluations)
+                "voice_match": row.voice_match,
+                "coherence": row.coherence,
+                "engaging": row.engaging,
+                "meets_brief": row.meets_brief,
+                "overall_quality": row.overall_quality
             }
             
-            # Find best model and strategy for this task
-            best_eval = max(evaluations, key=lambda e: e.overall_quality)
-            best_gen = best_eval.generation
-            
             results.append(TaskAnalysis(
-                task_id=task.id,
-                task_title=task.title,
-                content_type=task.content_type.value,
+                task_id=row.id,
+                task_title=row.title,
+                content_type=row.content_type.value,
                 avg_scores={k: round(v, 2) for k, v in avg_scores.items()},
-                best_model=f"{best_gen.model_provider.value}/{best_gen.model_name}",
-                best_strategy=best_gen.prompt_strategy.value,
-                evaluation_count=len(evaluations)
+                best_model=f"{row.model_provider.value}/{row.model_name}",
+                best_strategy=row.prompt_strategy.value,
+                evaluation_count=row.evaluation_count
             ))
         
         return results
     
-    def export_to_csv(self, db: Session, experiment_id: int) -> str:
-        """Export all evaluation data to CSV format"""
+    def export_to_csv(self, db: Session, experiment_id: int) -> Iterator[bytes]:
+        """Export all evaluation data to CSV format, yielding it in chunks"""
         
-        # Get all evaluations with related data
-        evaluations = db.query(Evaluation).filter(
+        # Select exactly the exported columns as plain rows, skipping ORM
+        # object construction, and stream them from the database in batches
+        stmt = select(
+            Evaluation.id,
+            Task.id,
+            Task.title,
+            Task.content_type,
+            Generation.model_provider,
+            Generation.model_name,
+            Generation.prompt_strategy,
+            Evaluation.voice_match,
+            Evaluation.coherence,
+            Evaluation.engaging,
+            Evaluation.meets_brief,
+            Evaluation.overall_quality,
+            Evaluation.would_publish,
+            Evaluation.edit_time_minutes,
+            Evaluation.notes,
+            Generation.cost_usd,
+            Generation.latency_ms,
+            Evaluation.evaluated_at
+        ).select_from(Evaluation).join(
+            Generation, Evaluation.generation_id == Generation.id
+        ).join(
+            Task, Generation.task_id == Task.id
+        ).where(
             Evaluation.experiment_id == experiment_id
-        ).all()
+        )
         
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
+        result = db.execute(stmt, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+        
+        # Write CSV straight into a UTF-8 byte buffer that is flushed after
+        # every batch, so the response needs no separate encode pass
+        output = io.BytesIO()
+        text = io.TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+        writer = csv.writer(text)
         
         # Write header
         writer.writerow([
@@ -272,66 +361,50 @@ class AnalysisService:
             "Evaluated At"
         ])
         
-        # Write data rows
-        for eval in evaluations:
-            gen = eval.generation
-            task = gen.task
-            
-            writer.writerow([
-                eval.id,
-                task.id,
-                task.title,
-                task.content_type.value,
-                gen.model_provider.value,
-                gen.model_name,
-                gen.prompt_strategy.value,
-                eval.voice_match,
-                eval.coherence,
-                eval.engaging,
-                eval.meets_brief,
-                eval.overall_quality,
-                eval.would_publish,
-                eval.edit_time_minutes,
-                eval.notes or "",
-                gen.cost_usd,
-                gen.latency_ms,
-                eval.evaluated_at.isoformat()
-            ])
+        # Write data rows, converting enums and timestamps to their CSV form
+        for batch in result.partitions():
+            writer.writerows(
+                (eval_id, task_id, title, content_type.value, provider.value,
+                 model_name, strategy.value, *scores, would_publish,
+                 edit_time, notes or "", cost, latency, evaluated_at.isoformat())
+                for (eval_id, task_id, title, content_type, provider, model_name,
+                     strategy, *scores, would_publish, edit_time, notes, cost,
+                     latency, evaluated_at) in batch
+            )
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
         
-        return output.getvalue()
+        yield output.getvalue()
+        text.close()
     
+    @_cached_per_experiment
     def get_heatmap_data(self, db: Session, experiment_id: int) -> Dict:
         """Get data for heatmap visualization (model vs strategy)"""
         
-        # Get all unique combinations
-        combinations = db.query(
+        # Average overall quality for every combination in one query; the
+        # outer join keeps combinations that have no evaluations yet
+        combinations = db.execute(lambda_stmt(lambda: select(
             Generation.model_provider,
             Generation.model_name,
-            Generation.prompt_strategy
-        ).filter(
+            Generation.prompt_strategy,
+            func.avg(Evaluation.overall_quality).label("avg_quality")
+        ).outerjoin(
+            Evaluation, Evaluation.generation_id == Generation.id
+        ).where(
             Generation.experiment_id == experiment_id
-        ).distinct().all()
+        ).group_by(
+            Generation.model_provider,
+            Generation.model_name,
+            Generation.prompt_strategy
+        ))).all()
         
         heatmap_data = {}
         
-        for provider, model_name, strategy in combinations:
+        for provider, model_name, strategy, avg_quality in combinations:
             model_key = f"{provider.value}/{model_name}"
-            
-            if model_key not in heatmap_data:
-                heatmap_data[model_key] = {}
-            
-            # Get average overall quality for this combination
-            avg_quality = db.query(
-                func.avg(Evaluation.overall_quality)
-            ).join(Generation).filter(
-                and_(
-                    Generation.experiment_id == experiment_id,
-                    Generation.model_provider == provider,
-                    Generation.model_name == model_name,
-                    Generation.prompt_strategy == strategy
-                )
-            ).scalar()
-            
-            heatmap_data[model_key][strategy.value] = round(avg_quality, 2) if avg_quality else 0
+            heatmap_data.setdefault(model_key, {})[strategy.value] = (
+                round(avg_quality, 2) if avg_quality else 0
+            )
         
         return heatmap_data
\ No newline at end of file
@@ -1,19 +1,91 @@
-from sqlalchemy import create_engine
+from sqlalchemy import and_, create_engine, delete, event, func, inspect, select, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from app.models import Base, Task
-from typing import Generator
+from app.models import Base, Task, Generation, Evaluation
+from typing import AsyncGenerator, Generator
 import json
+import orjson
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/database.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+# asyncio drivers used by the async engine for each database backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+_url = make_url(DATABASE_URL)
+if _url.get_backend_name() not in ASYNC_DRIVERS:
+    raise RuntimeError(
+        f"Unsupported database backend '{_url.get_backend_name()}' in DATABASE_URL; "
+        f"supported backends are {', '.join(ASYNC_DRIVERS)}"
+    )
+ASYNC_DATABASE_URL = _url.set(drivername=ASYNC_DRIVERS[_url.get_backend_name()])
+
+# Connection pool settings for server databases: enough connections for
+# concurrent requests and generation runs, failing fast when exhausted, and
+# replacing connections that were dropped or have been open for 30 minutes
+POOL_OPTIONS = {
+    "pool_size": 20,
+    "max_overflow": 20,
+    "pool_timeout": 5,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800
+}
+
+def _json_serializer(value) -> str:
+    """Serialize JSON columns with orjson, decoding its bytes output"""
+    return orjson.dumps(value).decode()
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent reads and writes"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, fewer fsyncs
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB memory-mapped I/O
+    cursor.execute("PRAGMA cache_size=-65536")  # 64 MB page cache
+    cursor.close()
+
+if "sqlite" in DATABASE_URL:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads
+    )
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        **POOL_OPTIONS,
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for code that runs on the event loop, such as generation
+if "sqlite" in DATABASE_URL:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads
+    )
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        **POOL_OPTIONS,
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads
+    )
+
+# Objects stay loaded after commit, since attribute access cannot await a refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db() -> Generator[Session, None, None]:
     db = SessionLocal()
     try:
@@ -21,6 +93,10 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
@@ -28,8 +104,119 @@ def init_db():
     
     # Create all tables
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
     print("Database initialized successfully")
 
+def upgrade_schema():
+    """Bring tables of an existing database up to date with the models.
+    
+    create_all skips tables that already exist, so columns and indexes added
+    to the models since the database was created are added here. New columns
+    must be nullable.
+    """
+    inspector = inspect(engine)
+    
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    ))
+        
+        existing_indexes = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.unique and _is_combination_index(index):
+                # Older databases may hold several generations per combination,
+                # which its unique index cannot be built over
+                if _has_duplicate_generations():
+                    print(f"Duplicate generations found, skipping unique index {index.name}; "
+                          f"run remove_duplicate_generations() to remove them")
+                    continue
+                # Replace the non-unique version of the index created before
+                existing = existing_indexes.get(index.name)
+                if existing is not None and not existing["unique"]:
+                    index.drop(bind=engine)
+            index.create(bind=engine, checkfirst=True)
+    
+    # Fill the combination columns copied onto evaluations for rows
+    # submitted before those columns existed
+    with engine.begin() as conn:
+        conn.execute(
+            update(Evaluation).where(Evaluation.model_provider.is_(None)).values({
+                column: select(getattr(Generation, column.key)).where(
+                    Generation.id == Evaluation.generation_id
+                ).scalar_subquery()
+                for column in (Evaluation.task_id, Evaluation.model_provider,
+                               Evaluation.model_name, Evaluation.prompt_strategy)
+            })
+        )
+
+# Columns identifying one generation combination
+GENERATION_COMBINATION = (
+    Generation.experiment_id,
+    Generation.task_id,
+    Generation.model_provider,
+    Generation.model_name,
+    Generation.prompt_strategy
+)
+
+def _is_combination_index(index) -> bool:
+    return [column.key for column in index.columns] == [column.key for column in GENERATION_COMBINATION] \
+        and index.table is Generation.__table__
+
+def _duplicated_combinations():
+    return select(*GENERATION_COMBINATION).group_by(
+        *GENERATION_COMBINATION
+    ).having(func.count() > 1)
+
+def _has_duplicate_generations() -> bool:
+    with engine.connect() as conn:
+        return conn.execute(select(_duplicated_combinations().exists())).scalar()
+
+def remove_duplicate_generations() -> bool:
+    """Delete extra generations of each combination, returning whether none remain.
+    
+    The evaluated generation of a combination is kept, else one with content,
+    else the latest. Evaluated duplicates are never deleted, so their
+    evaluations survive. Run this by hand, then restart to add the unique
+    index on combinations.
+    """
+    duplicated = _duplicated_combinations().subquery()
+    
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(
+                Generation.id,
+                *GENERATION_COMBINATION,
+                Generation.generated_content,
+                func.count(Evaluation.id).label("evaluation_count")
+            ).join(
+                duplicated, and_(*(column == duplicated.c[column.key] for column in GENERATION_COMBINATION))
+            ).outerjoin(
+                Evaluation, Evaluation.generation_id == Generation.id
+            ).group_by(Generation.id)
+        ).all()
+        
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row[1:len(GENERATION_COMBINATION) + 1]), []).append(row)
+        
+        duplicate_ids = []
+        unique = True
+        for group in groups.values():
+            kept = max(group, key=lambda row: (row.evaluation_count > 0, bool(row.generated_content), row.id))
+            duplicate_ids.extend(row.id for row in group if row is not kept and not row.evaluation_count)
+            unique = unique and sum(1 for row in group if row.evaluation_count) <= 1
+        
+        if duplicate_ids:
+            conn.execute(delete(Generation).where(Generation.id.in_(duplicate_ids)))
+            print(f"Removed {len(duplicate_ids)} duplicate generations")
+    
+    return unique
+
 def load_tasks(json_path: str = "data/tasks.json"):
     """Load tasks from JSON file into database"""
     db = SessionLocal()
@@ -45,17 +232,18 @@ def load_tasks(json_path: str = "data/tasks.json"):
         with open(json_path, 'r') as f:
             data = json.load(f)
         
-        # Create Task objects
-        for task_data in data['tasks']:
-            task = Task(
-                id=task_data['id'],
-                content_type=task_data['content_type'],
-                title=task_data['title'],
-                description=task_data['description'],
-                structured_prompt=task_data['structured_prompt'],
-                example_prompt_template=task_data['example_prompt_template']
-            )
-            db.add(task)
+        # Insert all tasks in one batch, without building ORM objects
+        db.bulk_insert_mappings(Task, [
+            {
+                "id": task_data['id'],
+                "content_type": task_data['content_type'],
+                "title": task_data['title'],
+                "description": task_data['description'],
+                "structured_prompt": task_data['structured_prompt'],
+                "example_prompt_template": task_data['example_prompt_template']
+            }
+            for task_data in data['tasks']
+        ])
         
         db.commit()
         print(f"Successfully loaded {len(data['tasks'])} tasks")
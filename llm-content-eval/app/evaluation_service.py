@@ -1,61 +1,110 @@
-import random
-import string
+import base64
+import secrets
 import time
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func, select
+from app.experiment_cache import ExperimentCache
 from app.models import Evaluation, Generation, Experiment, Task
-from app.schemas import BlindItem, EvaluationSubmit
+from app.schemas import BlindItem, EvaluationSubmit, EvaluationResponse
+
+# Evaluations fetched from the database and serialized per chunk when
+# streaming an experiment's evaluation list
+EVALUATION_LIST_BATCH_SIZE = 500
+
+_evaluation_list = TypeAdapter(List[EvaluationResponse])
+
+# Maximum number of experiments whose progress is cached, and how long each
+# entry stays valid. The TTL bounds staleness from writes the ORM events
+# below cannot see, such as other worker processes.
+PROGRESS_CACHE_SIZE = 256
+PROGRESS_CACHE_TTL_SECONDS = 10
+
+# Maps experiment_id to (total generations, completed evaluations). Entries
+# are dropped whenever a generation or evaluation of the experiment is
+# inserted or deleted through the ORM.
+_progress_cache = ExperimentCache(
+    "progress", PROGRESS_CACHE_SIZE, PROGRESS_CACHE_TTL_SECONDS,
+    models=(Generation, Evaluation),
+    events=("after_insert", "after_delete")
+)
+invalidate_progress_cache = _progress_cache.invalidate
 
 class EvaluationService:
-    def __init__(self):
-        self.blind_id_cache = {}  # Maps blind_id to generation_id
-        
+    
     def generate_blind_id(self) -> str:
         """Generate a random blind ID"""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        # 40 random bits encode to exactly 8 base32 characters (A-Z, 2-7)
+        return base64.b32encode(secrets.token_bytes(5)).decode()
     
     def get_next_blind_item(self, db: Session, experiment_id: int) -> Optional[BlindItem]:
         """Get the next unevaluated generation for blind evaluation"""
         
-        # Find generations without evaluations
-        unevaluated = db.query(Generation).filter(
+        # Pick a random unevaluated generation in the database, fetching only
+        # the columns the blind item needs. Generations not handed out yet
+        # come first; once none are left, pending ones are handed out again
+        # under their existing blind ID, so abandoned items still get evaluated
+        row = db.query(
+            Generation.id,
+            Generation.pending_blind_id,
+            Generation.generated_content,
+            Task.title,
+            Task.description,
+            Task.content_type
+        ).join(
+            Task, Task.id == Generation.task_id
+        ).outerjoin(
+            Evaluation, Evaluation.generation_id == Generation.id
+        ).filter(
             and_(
                 Generation.experiment_id == experiment_id,
-                ~Generation.evaluation.has()  # No evaluation exists
+                Generation.generated_content.isnot(None),  # Not still being generated
+                Evaluation.id.is_(None)  # No evaluation exists
             )
-        ).all()
+        ).order_by(Generation.pending_blind_id.isnot(None), func.random()).first()
         
-        if not unevaluated:
+        if not row:
             return None
         
-        # Pick a random unevaluated generation
-        generation = random.choice(unevaluated)
+        blind_id = row.pending_blind_id
+        if blind_id is None:
+            # Persist a new blind ID so any worker can resolve it on submit,
+            # unless a concurrent request has just handed the item out
+            blind_id = self.generate_blind_id()
+            claimed = db.query(Generation).filter(
+                Generation.id == row.id,
+                Generation.pending_blind_id.is_(None)
+            ).update({Generation.pending_blind_id: blind_id}, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                blind_id = db.query(Generation.pending_blind_id).filter(
+                    Generation.id == row.id
+                ).scalar()
         
-        # Generate blind ID
-        blind_id = self.generate_blind_id()
-        self.blind_id_cache[blind_id] = generation.id
-        
-        # Get task details
-        task = db.query(Task).filter(Task.id == generation.task_id).first()
-        
-        return BlindItem(
+        item = BlindItem(
             blind_id=blind_id,
-            content=generation.generated_content,
-            task_title=task.title,
-            task_description=task.description,
-            content_type=task.content_type.value
+            content=row.generated_content,
+            task_title=row.title,
+            task_description=row.description,
+            content_type=row.content_type.value
         )
+        
+        return item
     
     def submit_evaluation(self, db: Session, evaluation_data: EvaluationSubmit, 
                          evaluation_time_seconds: int = None) -> Evaluation:
         """Submit an evaluation for a blind item"""
         
-        # Get generation ID from blind ID
-        generation_id = self.blind_id_cache.get(evaluation_data.blind_id)
-        if not generation_id:
+        # Get generation from blind ID, along with any evaluation it already has
+        match = db.query(Generation, Evaluation.id).outerjoin(
+            Evaluation, Evaluation.generation_id == Generation.id
+        ).filter(
+            Generation.pending_blind_id == evaluation_data.blind_id
+        ).first()
+        if not match:
             # Try to find existing evaluation with this blind_id
-            existing = db.query(Evaluation).filter(
+            existing = db.query(Evaluation.id).filter(
                 Evaluation.blind_id == evaluation_data.blind_id
             ).first()
             if existing:
@@ -63,16 +112,11 @@ class EvaluationService:
             else:
                 raise ValueError(f"Invalid blind_id: {evaluation_data.blind_id}")
         
-        # Get generation
-        generation = db.query(Generation).filter(Generation.id == generation_id).first()
-        if not generation:
-            raise ValueError(f"Generation {generation_id} not found")
+        generation, existing_eval_id = match
+        generation_id = generation.id
         
         # Check if evaluation already exists
-        existing_eval = db.query(Evaluation).filter(
-            Evaluation.generation_id == generation_id
-        ).first()
-        if existing_eval:
+        if existing_eval_id:
             raise ValueError(f"Evaluation already exists for generation {generation_id}")
         
         # Create evaluation
@@ -80,6 +124,10 @@ class EvaluationService:
             generation_id=generation_id,
             experiment_id=generation.experiment_id,
             blind_id=evaluation_data.blind_id,
+            task_id=generation.task_id,
+            model_provider=generation.model_provider,
+            model_name=generation.model_name,
+            prompt_strategy=generation.prompt_strategy,
             voice_match=evaluation_data.voice_match,
             coherence=evaluation_data.coherence,
             engaging=evaluation_data.engaging,
@@ -91,32 +139,41 @@ class EvaluationService:
             evaluation_time_seconds=evaluation_time_seconds
         )
         
+        # Release the blind ID along with saving the evaluation
+        generation.pending_blind_id = None
+        
         db.add(evaluation)
         db.commit()
         db.refresh(evaluation)
         
-        # Remove from cache
-        del self.blind_id_cache[evaluation_data.blind_id]
-        
         # Check if all evaluations are complete
-        self._check_experiment_completion(db, generation.experiment_id)
+        self._check_experiment_completion(db, evaluation.experiment_id)
         
         return evaluation
     
     def get_evaluation_progress(self, db: Session, experiment_id: int) -> Dict:
         """Get evaluation progress for an experiment"""
         
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+        experiment = db.query(Experiment.status).filter(
+            Experiment.id == experiment_id
+        ).first()
         if not experiment:
             return {"error": "Experiment not found"}
         
-        total_generations = db.query(Generation).filter(
-            Generation.experiment_id == experiment_id
-        ).count()
+        counts = _progress_cache.get(experiment_id)
+        if counts is None:
+            total_generations = db.query(Generation).filter(
+                Generation.experiment_id == experiment_id
+            ).count()
+            
+            completed_evaluations = db.query(Evaluation).filter(
+                Evaluation.experiment_id == experiment_id
+            ).count()
+            
+            counts = (total_generations, completed_evaluations)
+            _progress_cache.set(experiment_id, counts)
         
-        completed_evaluations = db.query(Evaluation).filter(
-            Evaluation.experiment_id == experiment_id
-        ).count()
+        total_generations, completed_evaluations = counts
         
         return {
             "experiment_id": experiment_id,
@@ -127,32 +184,51 @@ class EvaluationService:
             "percentage": round((completed_evaluations / total_generations) * 100, 1) if total_generations > 0 else 0
         }
     
-    def skip_blind_item(self, blind_id: str) -> bool:
-        """Skip a blind item (remove from cache)"""
-        if blind_id in self.blind_id_cache:
-            del self.blind_id_cache[blind_id]
-            return True
-        return False
+    def skip_blind_item(self, db: Session, blind_id: str) -> bool:
+        """Skip a blind item (release its blind ID)"""
+        released = db.query(Generation).filter(
+            Generation.pending_blind_id == blind_id
+        ).update({Generation.pending_blind_id: None}, synchronize_session=False)
+        db.commit()
+        return released > 0
     
-    def get_all_evaluations(self, db: Session, experiment_id: int) -> List[Evaluation]:
-        """Get all evaluations for an experiment"""
-        return db.query(Evaluation).filter(
+    def stream_all_evaluations(self, db: Session, experiment_id: int) -> Iterator[bytes]:
+        """Get all evaluations for an experiment as a JSON array, yielding it in chunks"""
+        
+        # Select the response columns as plain rows and stream them from the
+        # database in batches, so memory stays bounded by one batch
+        stmt = select(
+            *(getattr(Evaluation, name) for name in EvaluationResponse.model_fields)
+        ).where(
             Evaluation.experiment_id == experiment_id
-        ).all()
+        ).order_by(Evaluation.id)
+        
+        result = db.execute(stmt, execution_options={"yield_per": EVALUATION_LIST_BATCH_SIZE})
+        
+        # Serialize each batch as a JSON array and splice the arrays together
+        yield b"["
+        separator = b""
+        for batch in result.mappings().partitions():
+            evaluations = _evaluation_list.validate_python(batch)
+            yield separator + _evaluation_list.dump_json(evaluations)[1:-1]
+            separator = b","
+        yield b"]"
     
     def _check_experiment_completion(self, db: Session, experiment_id: int):
         """Check if all generations have been evaluated and update experiment status"""
         
-        total_generations = db.query(Generation).filter(
+        # Count generations and their evaluations in one pass
+        total_generations, total_evaluations = db.query(
+            func.count(Generation.id),
+            func.count(Evaluation.id)
+        ).outerjoin(
+            Evaluation, Evaluation.generation_id == Generation.id
+        ).filter(
             Generation.experiment_id == experiment_id
-        ).count()
-        
-        total_evaluations = db.query(Evaluation).filter(
-            Evaluation.experiment_id == experiment_id
-        ).count()
+        ).one()
         
         if total_generations > 0 and total_generations == total_evaluations:
-            experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+            experiment = db.get(Experiment, experiment_id)
             if experiment:
                 experiment.status = "complete"
                 db.commit()
@@ -160,32 +236,48 @@ class EvaluationService:
     def reveal_generation_details(self, db: Session, blind_id: str) -> Dict:
         """Reveal the details of a generation after evaluation"""
         
-        evaluation = db.query(Evaluation).filter(
+        row = db.query(
+            Generation.model_provider,
+            Generation.model_name,
+            Generation.prompt_strategy,
+            Generation.cost_usd,
+            Generation.latency_ms,
+            Task.title,
+            Task.content_type,
+            Evaluation.voice_match,
+            Evaluation.coherence,
+            Evaluation.engaging,
+            Evaluation.meets_brief,
+            Evaluation.overall_quality,
+            Evaluation.would_publish,
+            Evaluation.edit_time_minutes
+        ).join(
+            Generation, Generation.id == Evaluation.generation_id
+        ).join(
+            Task, Task.id == Generation.task_id
+        ).filter(
             Evaluation.blind_id == blind_id
         ).first()
         
-        if not evaluation:
+        if not row:
             return {"error": "Evaluation not found"}
         
-        generation = evaluation.generation
-        task = generation.task
-        
         return {
             "blind_id": blind_id,
-            "model_provider": generation.model_provider.value,
-            "model_name": generation.model_name,
-            "prompt_strategy": generation.prompt_strategy.value,
-            "task_title": task.title,
-            "content_type": task.content_type.value,
-            "cost_usd": generation.cost_usd,
-            "latency_ms": generation.latency_ms,
+            "model_provider": row.model_provider.value,
+            "model_name": row.model_name,
+            "prompt_strategy": row.prompt_strategy.value,
+            "task_title": row.title,
+            "content_type": row.content_type.value,
+            "cost_usd": row.cost_usd,
+            "latency_ms": row.latency_ms,
             "scores": {
-                "voice_match": evaluation.voice_match,
-                "coherence": evaluation.coherence,
-                "engaging": evaluation.engaging,
-                "meets_brief": evaluation.meets_brief,
-                "overall_quality": evaluation.overall_quality
+                "voice_match": row.voice_match,
+                "coherence": row.coherence,
+                "engaging": row.engaging,
+                "meets_brief": row.meets_brief,
+                "overall_quality": row.overall_quality
             },
-            "would_publish": evaluation.would_publish,
-            "edit_time_minutes": evaluation.edit_time_minutes
+            "would_publish": row.would_publish,
+            "edit_time_minutes": row.edit_time_minutes
         }
\ No newline at end of file
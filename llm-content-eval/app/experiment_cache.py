@@ -0,0 +1,57 @@
+import threading
+from typing import Any, Iterable, Set
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+class ExperimentCache:
+    """Thread-safe TTL cache of results computed per experiment.
+    
+    An experiment may hold several named results. They are all dropped
+    whenever a row of one of the watched models is written for the
+    experiment through the ORM. Core and bulk writes skip those events, so
+    their callers invalidate the experiment themselves; the TTL bounds
+    staleness from writes no event sees, such as other worker processes.
+    """
+    
+    def __init__(self, name: str, maxsize: int, ttl: float,
+                 models: Iterable[type], events: Iterable[str]):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._names: Set[str] = set()
+        self._stale_key = f"stale_{name}"
+        
+        for model in models:
+            for name in events:
+                event.listen(model, name, self._mark_stale)
+        event.listen(Session, "after_commit", self._drop_stale)
+        event.listen(Session, "after_rollback", self._drop_stale)
+    
+    def get(self, experiment_id: int, name: str = "", default: Any = None) -> Any:
+        with self._lock:
+            return self._cache.get((experiment_id, name), default)
+    
+    def set(self, experiment_id: int, value: Any, name: str = "") -> None:
+        with self._lock:
+            self._names.add(name)
+            self._cache[(experiment_id, name)] = value
+    
+    def invalidate(self, experiment_id: int) -> None:
+        """Drop every cached result for an experiment, e.g. after a bulk write"""
+        with self._lock:
+            for name in self._names:
+                self._cache.pop((experiment_id, name), None)
+    
+    def _mark_stale(self, mapper, connection, target):
+        """Drop cached results for the row's experiment, again once committed"""
+        self.invalidate(target.experiment_id)
+        
+        # A concurrent request may re-cache pre-commit results between the
+        # flush and the commit, so drop the entries a second time after commit
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(self._stale_key, set()).add(target.experiment_id)
+    
+    def _drop_stale(self, session):
+        for experiment_id in session.info.pop(self._stale_key, ()):
+            self.invalidate(experiment_id)
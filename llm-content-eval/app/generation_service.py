@@ -1,169 +1,687 @@
 import random
 import asyncio
+import re
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
-from app.models import Generation, Experiment, Task, ModelProvider, PromptStrategy
-from app.llm_clients import LLMClient
-from config import MODELS
+from aiolimiter import AsyncLimiter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app.models import Generation, Experiment, Task, LLMResponseCache, ModelProvider, PromptStrategy
+from app.llm_clients import LLMClient, BATCH_PROVIDERS, response_cache_key
+from app.analysis_service import invalidate_analysis_cache
+from app.evaluation_service import invalidate_progress_cache
+from config import MODELS, PROVIDER_LIMITS, BATCH_POLL_INTERVAL_SECONDS
+
+# Sample placeholders in example-based prompt templates
+SAMPLE_PLACEHOLDER = re.compile(r"\{(sample1|sample2)\}")
+
+# Seconds after which a placeholder whose LLM call never finished, e.g.
+# because the process stopped, may be claimed again
+GENERATION_CLAIM_TIMEOUT_SECONDS = 600
+
+def _combination_filter(experiment_id: int, task_id: str, provider: str,
+                        model: str, strategy: PromptStrategy):
+    return and_(
+        Generation.experiment_id == experiment_id,
+        Generation.task_id == task_id,
+        Generation.model_provider == provider,
+        Generation.model_name == model,
+        Generation.prompt_strategy == strategy
+    )
+
+def _retryable_generation():
+    """Match unevaluated generations whose LLM call failed or was abandoned"""
+    abandoned_before = datetime.utcnow() - timedelta(seconds=GENERATION_CLAIM_TIMEOUT_SECONDS)
+    return and_(
+        or_(
+            Generation.generated_content == "",
+            and_(Generation.generated_content.is_(None), Generation.timestamp < abandoned_before)
+        ),
+        ~Generation.evaluation.has()
+    )
+
+class GenerationInProgressError(ValueError):
+    """Raised when another request is already generating a combination"""
+
+def _insert_new_generations(dialect_name: str):
+    """Build an INSERT into generations that skips combinations already saved"""
+    if dialect_name == "postgresql":
+        return postgresql.insert(Generation).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(Generation).on_conflict_do_nothing()
+    return insert(Generation)
+
+class _GenerationWriter:
+    """Buffer an experiment run's completed generation rows and save them in bulk.
+    
+    The session is shared by every concurrent combination of the run, so its
+    commits are serialized by the writer's lock. Rows that finish while
+    another save holds the lock wait for it and are then inserted together
+    in one executemany, so commits stay few under heavy concurrency.
+    """
+    
+    def __init__(self, db: AsyncSession, experiment: Experiment, retryable_ids: Dict):
+        self.db = db
+        self.experiment = experiment
+        self.lock = asyncio.Lock()
+        # Maps (task_id, provider, model, strategy) to the failed row a
+        # regenerated combination overwrites in place
+        self.retryable_ids = retryable_ids
+        # Generation rows completed but not yet saved
+        self.unsaved_rows: List[Dict] = []
+    
+    def add(self, row: Dict) -> None:
+        """Buffer a row to be written by the next save"""
+        self.unsaved_rows.append(row)
+    
+    async def save(self, rows: List[Dict] = ()) -> None:
+        """Save the given rows along with every buffered one.
+        
+        Combinations saved meanwhile by another run of the experiment are
+        skipped. Rows that fail to save, e.g. while the database is locked,
+        are kept for the next save.
+        """
+        self.unsaved_rows.extend(rows)
+        async with self.lock:
+            if not self.unsaved_rows:
+                return
+            saving = self.unsaved_rows[:]
+            
+            new_rows = []
+            retried_rows = []
+            for row in saving:
+                generation_id = self.retryable_ids.get(
+                    (row["task_id"], row["model_provider"], row["model_name"], row["prompt_strategy"])
+                )
+                if generation_id is None:
+                    new_rows.append(row)
+                else:
+                    retried_rows.append({**row, "id": generation_id, "timestamp": datetime.utcnow()})
+            
+            try:
+                if new_rows:
+                    await self.db.execute(_insert_new_generations(self.db.bind.dialect.name), new_rows)
+                if retried_rows:
+                    await self.db.execute(update(Generation), retried_rows)
+                await self.db.commit()
+            except SQLAlchemyError as e:
+                # Roll back so the session stays usable, and reload the
+                # experiment the rollback expired
+                print(f"Error saving {len(saving)} generations, keeping them for the next save: {e}")
+                await self.db.rollback()
+                await self.db.refresh(self.experiment)
+                return
+            del self.unsaved_rows[:len(saving)]
+        
+        # Bulk inserts skip the ORM events that keep these caches fresh
+        invalidate_analysis_cache(self.experiment.id)
+        invalidate_progress_cache(self.experiment.id)
 
 class GenerationService:
     def __init__(self):
         self.llm_client = LLMClient()
         
+        # Generation parameters for each provider, resolved once
+        self._params_by_provider = {
+            provider: config["params"] for provider, config in MODELS.items()
+        }
+        
+        # Bound in-flight calls and throttle request rate per provider
+        self._semaphores = {
+            provider: asyncio.Semaphore(limits["concurrency"])
+            for provider, limits in PROVIDER_LIMITS.items()
+        }
+        self._rate_limiters = {
+            provider: AsyncLimiter(limits["rpm"], 60)
+            for provider, limits in PROVIDER_LIMITS.items()
+        }
+        
+    def pick_sample_pair(self, baseline_samples: List[str],
+                         rng: random.Random = random) -> List[str]:
+        """Select the two baseline samples for an example-based prompt"""
+        if len(baseline_samples) >= 2:
+            return rng.sample(baseline_samples, 2)
+        # If less than 2 samples, use what we have
+        return baseline_samples + baseline_samples  # Duplicate if only 1
+    
     def prepare_prompt(self, task: Task, strategy: PromptStrategy, 
-                      baseline_samples: List[str]) -> str:
-        """Prepare the prompt based on strategy"""
+                      samples: List[str]) -> str:
+        """Prepare the prompt based on strategy, using the given sample pair"""
         if strategy == PromptStrategy.STRUCTURED:
             return task.structured_prompt
         elif strategy == PromptStrategy.EXAMPLE_BASED:
-            # Select two random samples for the example-based prompt
-            if len(baseline_samples) >= 2:
-                samples = random.sample(baseline_samples, 2)
-            else:
-                # If less than 2 samples, use what we have
-                samples = baseline_samples + baseline_samples  # Duplicate if only 1
-                
-            prompt = task.example_prompt_template
-            prompt = prompt.replace("{sample1}", samples[0] if samples else "")
-            prompt = prompt.replace("{sample2}", samples[1] if len(samples) > 1 else "")
-            return prompt
+            values = {
+                "sample1": samples[0] if samples else "",
+                "sample2": samples[1] if len(samples) > 1 else ""
+            }
+            # Substitute both placeholders in one pass over the template
+            return SAMPLE_PLACEHOLDER.sub(lambda match: values[match.group(1)],
+                                          task.example_prompt_template)
         else:
             raise ValueError(f"Unknown strategy: {strategy}")
     
     async def generate_single(self, 
-                            db: Session,
+                            db: AsyncSession,
                             experiment_id: int,
                             task_id: str,
                             provider: str,
                             model: str,
                             strategy: PromptStrategy) -> Generation:
-        """Generate a single piece of content"""
+        """Generate a single piece of content, or return the combination's existing one.
+        
+        The combination is claimed with a placeholder row before the LLM is
+        called, so concurrent requests for it make a single call. A failed
+        generation is claimed again and regenerated in place.
+        """
         
-        # Get experiment and task
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+        # Get the experiment's baseline samples and the task
+        experiment = (await db.execute(
+            select(Experiment.baseline_samples, Experiment.bypass_cache)
+            .where(Experiment.id == experiment_id)
+        )).first()
         if not experiment:
             raise ValueError(f"Experiment {experiment_id} not found")
             
-        task = db.query(Task).filter(Task.id == task_id).first()
+        task = await db.get(Task, task_id)
         if not task:
             raise ValueError(f"Task {task_id} not found")
         
-        # Prepare prompt
-        prompt = self.prepare_prompt(task, strategy, experiment.baseline_samples)
+        samples = None
+        if strategy == PromptStrategy.EXAMPLE_BASED:
+            samples = self.pick_sample_pair(experiment.baseline_samples)
+        
+        prompt = self.prepare_prompt(task, strategy, samples)
+        key = response_cache_key(provider, model, prompt, self._params_by_provider[provider])
+        
+        combination = _combination_filter(experiment_id, task_id, provider, model, strategy)
+        
+        # Claim the combination with a placeholder whose content is NULL until
+        # the LLM responds: reuse a failed generation, else insert a new row,
+        # which is skipped if the combination exists
+        generation_id = (await db.execute(
+            update(Generation).where(combination, _retryable_generation()).values(
+                generated_content=None,
+                prompt_used=prompt,
+                timestamp=datetime.utcnow()
+            ).returning(Generation.id).execution_options(synchronize_session=False)
+        )).scalar()
+        try:
+            if generation_id is None:
+                generation_id = (await db.execute(
+                    _insert_new_generations(db.bind.dialect.name).values(
+                        experiment_id=experiment_id,
+                        task_id=task_id,
+                        model_provider=provider,
+                        model_name=model,
+                        prompt_strategy=strategy,
+                        prompt_used=prompt,
+                        cost_usd=0
+                    ).returning(Generation.id)
+                )).scalar()
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            generation_id = None
+        
+        if generation_id is None:
+            existing = (await db.execute(
+                select(Generation).where(combination)
+            )).scalars().first()
+            if existing.generated_content is None:
+                raise GenerationInProgressError(
+                    f"Generation for {provider}/{model}/{strategy.value}/{task_id} is already in progress"
+                )
+            return existing
+        
+        try:
+            cached = None if experiment.bypass_cache else await db.get(LLMResponseCache, key)
+            if cached:
+                row = self._cached_row(experiment_id, task_id, provider, model, strategy, prompt, cached)
+            else:
+                row = await self._build_generation(
+                    experiment_id, task_id, provider, model, strategy, prompt
+                )
+        except BaseException:
+            # Record the call as failed rather than leave the claim in progress
+            await db.rollback()
+            await db.execute(
+                update(Generation).where(Generation.id == generation_id).values(generated_content="")
+            )
+            await db.commit()
+            raise
+        
+        await db.execute(
+            update(Generation).where(Generation.id == generation_id).values(**row, timestamp=datetime.utcnow())
+        )
+        await db.commit()
+        
+        # Cache the response separately, so a concurrent request caching the
+        # same call cannot roll back the generation
+        if not cached and row["generated_content"]:
+            try:
+                await db.merge(self._cache_entry(key, row))
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+        
+        # Core writes skip the ORM events that keep these caches fresh
+        invalidate_analysis_cache(experiment_id)
+        invalidate_progress_cache(experiment_id)
+        
+        return await db.get(Generation, generation_id, populate_existing=True)
+    
+    async def _build_generation(self,
+                                experiment_id: int,
+                                task_id: str,
+                                provider: str,
+                                model: str,
+                                strategy: PromptStrategy,
+                                prompt: str) -> Dict:
+        """Call the LLM for one combination and return its generation row"""
         
         # Get generation parameters
-        params = MODELS[provider]["params"]
+        params = self._params_by_provider[provider]
         
         # Generate content
-        content, metadata = self.llm_client.generate(provider, model, prompt, params)
-        
-        # Create generation record
-        generation = Generation(
-            experiment_id=experiment_id,
-            task_id=task_id,
-            model_provider=provider,
-            model_name=model,
-            prompt_strategy=strategy,
-            prompt_used=prompt,
-            generated_content=content if content else "",
-            generation_params=params,
-            latency_ms=metadata.get("latency_ms", 0),
-            prompt_tokens=metadata.get("prompt_tokens", 0),
-            completion_tokens=metadata.get("completion_tokens", 0),
-            cost_usd=metadata.get("cost_usd", 0)
+        content, metadata = await self.llm_client.generate(provider, model, prompt, params)
+        
+        return self._generation_row(
+            experiment_id, task_id, provider, model, strategy,
+            prompt, params, content, metadata
         )
+    
+    def _cached_row(self, experiment_id: int, task_id: str, provider: str,
+                    model: str, strategy: PromptStrategy, prompt: str,
+                    cached: LLMResponseCache) -> Dict:
+        """Build a generation row from a cached response.
         
-        db.add(generation)
-        db.commit()
-        db.refresh(generation)
+        Latency, tokens and cost are those of the original call, so analysis
+        still compares the models as if they had been called again.
+        """
+        return self._generation_row(
+            experiment_id, task_id, provider, model, strategy, prompt,
+            self._params_by_provider[provider], cached.content, cached.response_metadata
+        )
+    
+    def _cache_entry(self, key: str, row: Dict) -> LLMResponseCache:
+        """Create the cache entry for a successful generation row"""
+        return LLMResponseCache(
+            hash=key,
+            content=row["generated_content"],
+            response_metadata={
+                "latency_ms": row["latency_ms"],
+                "prompt_tokens": row["prompt_tokens"],
+                "completion_tokens": row["completion_tokens"],
+                "cost_usd": row["cost_usd"]
+            }
+        )
+    
+    def _generation_row(self, experiment_id: int, task_id: str, provider: str,
+                        model: str, strategy: PromptStrategy, prompt: str,
+                        params: Dict, content: Optional[str], metadata: Dict) -> Dict:
+        """Build the column values of a generation from an LLM response"""
+        return {
+            "experiment_id": experiment_id,
+            "task_id": task_id,
+            "model_provider": provider,
+            "model_name": model,
+            "prompt_strategy": strategy,
+            "prompt_used": prompt,
+            "generated_content": content if content else "",
+            "generation_params": params,
+            "latency_ms": metadata.get("latency_ms", 0),
+            "prompt_tokens": metadata.get("prompt_tokens", 0),
+            "completion_tokens": metadata.get("completion_tokens", 0),
+            "cost_usd": metadata.get("cost_usd", 0),
+            "retry_count": metadata.get("retries", 0)
+        }
+    
+    async def _run_batch(self, writer: _GenerationWriter, provider: str,
+                         requests: List, report_progress) -> None:
+        """Generate one provider's combinations through its batch API.
         
-        return generation
+        Each request is (future, model, strategy, task_id, prompt); every future is
+        resolved with its generation row once the rows are saved, or with the
+        error that stopped the batch. A batch submitted by an interrupted run
+        is polled again instead of being submitted twice.
+        """
+        db, experiment = writer.db, writer.experiment
+        try:
+            params = self._params_by_provider[provider]
+            pending = []
+            
+            for request in requests:
+                future, model, strategy, task_id, prompt = request
+                pending.append((request, {
+                    # Identify requests by their call, so a resumed run matches
+                    # the results of the batch it submitted before
+                    "custom_id": f"gen-{response_cache_key(provider, model, prompt, params)}",
+                    "model": model,
+                    "prompt": prompt,
+                    "params": params
+                }))
+            
+            batch_id = (experiment.batch_ids or {}).get(provider)
+            resumed = batch_id is not None
+            
+            while pending:
+                batch = [batch_request for _, batch_request in pending]
+                if batch_id is None:
+                    batch_id = await self.llm_client.submit_batch(provider, batch)
+                    # The session is shared with the other batches, so commit under the lock
+                    async with writer.lock:
+                        experiment.batch_ids = {**(experiment.batch_ids or {}), provider: batch_id}
+                        await db.commit()
+                
+                results = None
+                while results is None:
+                    await asyncio.sleep(BATCH_POLL_INTERVAL_SECONDS)
+                    results = await self.llm_client.poll_batch(provider, batch_id, batch)
+                
+                # A batch resumed from an interrupted run has no results for
+                # combinations it did not contain; those go into a new batch
+                finished = [
+                    (request, batch_request) for request, batch_request in pending
+                    if not resumed or batch_request["custom_id"] in results
+                ]
+                pending = [
+                    (request, batch_request) for request, batch_request in pending
+                    if resumed and batch_request["custom_id"] not in results
+                ]
+                
+                rows = []
+                for (future, model, strategy, task_id, prompt), batch_request in finished:
+                    content, metadata = results.get(batch_request["custom_id"], (None, {}))
+                    rows.append(self._generation_row(
+                        experiment.id, task_id, provider, model, PromptStrategy(strategy),
+                        prompt, params, content, metadata
+                    ))
+                await writer.save(rows)
+                
+                # The batch's results are saved, so a later run submits a new one
+                async with writer.lock:
+                    experiment.batch_ids = {
+                        key: value for key, value in experiment.batch_ids.items() if key != provider
+                    }
+                    await db.commit()
+                
+                for ((future, *_), _), row in zip(finished, rows):
+                    future.set_result(row)
+                    report_progress()
+                
+                batch_id = None
+                resumed = False
+                
+        except Exception as e:
+            for future, *_ in requests:
+                if not future.done():
+                    future.set_exception(e)
+                    report_progress()
     
     async def generate_all_for_experiment(self, 
-                                         db: Session, 
+                                         db: AsyncSession, 
                                          experiment_id: int,
                                          progress_callback=None) -> List[Generation]:
         """Generate all content for an experiment"""
         
         # Get experiment
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+        experiment = await db.get(Experiment, experiment_id)
         if not experiment:
             raise ValueError(f"Experiment {experiment_id} not found")
         
         # Update status
         experiment.status = "generating"
-        db.commit()
+        await db.commit()
         
-        generations = []
         total_combinations = (len(experiment.selected_models) * 
                             len(experiment.selected_strategies) * 
                             len(experiment.selected_tasks))
         completed = 0
         
-        # Generate all combinations
+        def report_progress():
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, total_combinations)
+        
+        existing_generations, retryable_ids = await self._load_existing_generations(db, experiment_id)
+        combinations = await self._plan_combinations(db, experiment, existing_generations)
+        writer = _GenerationWriter(db, experiment, retryable_ids)
+        
+        reused, batch_jobs, pending = await self._schedule_combinations(
+            writer, combinations, report_progress
+        )
+        
+        # Save the cached responses up front, so progress counts them
+        await writer.save()
+        
+        try:
+            outcomes = await asyncio.gather(*batch_jobs, *pending, return_exceptions=True)
+        finally:
+            # Keep rows that finished but were not saved before a cancellation
+            await writer.save()
+        
+        if writer.unsaved_rows:
+            raise RuntimeError(f"{len(writer.unsaved_rows)} generations could not be saved")
+        
+        await self._cache_new_responses(db, experiment, combinations, reused, outcomes[len(batch_jobs):])
+        
+        # Update experiment status
+        experiment.status = "evaluating"
+        await db.commit()
+        
+        # Load the experiment's generations, including the rows just inserted
+        generations = await db.scalars(
+            select(Generation).where(Generation.experiment_id == experiment_id)
+        )
+        return list(generations)
+    
+    async def _load_existing_generations(self, db: AsyncSession, experiment_id: int):
+        """Load the combinations already generated for an experiment in one query.
+        
+        Returns the combinations to keep, and the row IDs of failed ones,
+        which are generated again, by combination.
+        """
+        existing_generations = set()
+        retryable_ids = {}
+        for task_id, provider, model, strategy, generation_id, retryable in await db.execute(
+            select(
+                Generation.task_id,
+                Generation.model_provider,
+                Generation.model_name,
+                Generation.prompt_strategy,
+                Generation.id,
+                _retryable_generation()
+            ).where(Generation.experiment_id == experiment_id)
+        ):
+            if retryable:
+                retryable_ids[(task_id, provider, model, strategy)] = generation_id
+            else:
+                existing_generations.add((task_id, provider, model, strategy))
+        return existing_generations, retryable_ids
+    
+    async def _plan_combinations(self, db: AsyncSession, experiment: Experiment,
+                                 existing_generations: set) -> List:
+        """List every combination of an experiment with its prompt and cache key.
+        
+        Each combination is (provider, model, strategy, task_id, prompt, key,
+        existing); prompt and key are None for existing combinations and
+        missing tasks.
+        """
+        # Load the selected tasks once for every combination
+        tasks = {
+            task.id: task
+            for task in await db.scalars(
+                select(Task).where(Task.id.in_(experiment.selected_tasks))
+            )
+        }
+        
+        # Sample pairs come from an RNG seeded by the experiment and are drawn
+        # for every combination in order, so a resumed run feeds the same
+        # examples to each prompt as an uninterrupted one
+        rng = random.Random(experiment.id)
+        baseline_samples = experiment.baseline_samples
+        
+        combinations = []
+        
         for model_config in experiment.selected_models:
             provider = model_config["provider"]
             model = model_config["model"]
             
             for strategy in experiment.selected_strategies:
                 for task_id in experiment.selected_tasks:
-                    try:
-                        # Check if this combination already exists
-                        existing = db.query(Generation).filter(
-                            Generation.experiment_id == experiment_id,
-                            Generation.task_id == task_id,
-                            Generation.model_provider == provider,
-                            Generation.prompt_strategy == strategy
-                        ).first()
-                        
-                        if existing:
-                            generations.append(existing)
-                        else:
-                            # Generate new content
-                            generation = await self.generate_single(
-                                db, experiment_id, task_id, 
-                                provider, model, PromptStrategy(strategy)
-                            )
-                            generations.append(generation)
-                            
-                            # Small delay to avoid rate limits
-                            await asyncio.sleep(1)
-                        
-                        completed += 1
-                        if progress_callback:
-                            progress_callback(completed, total_combinations)
-                            
-                    except Exception as e:
-                        print(f"Error generating {provider}/{model}/{strategy}/{task_id}: {e}")
-                        completed += 1
-                        if progress_callback:
-                            progress_callback(completed, total_combinations)
+                    # Check if this combination already exists
+                    existing = (task_id, provider, model, strategy) in existing_generations
+                    samples = None
+                    if strategy == PromptStrategy.EXAMPLE_BASED:
+                        samples = self.pick_sample_pair(baseline_samples, rng)
+                    
+                    prompt = key = None
+                    if not existing and task_id in tasks:
+                        prompt = self.prepare_prompt(tasks[task_id], PromptStrategy(strategy), samples)
+                        key = response_cache_key(provider, model, prompt, self._params_by_provider[provider])
+                    
+                    combinations.append((provider, model, strategy, task_id, prompt, key, existing))
         
-        # Update experiment status
-        experiment.status = "evaluating"
-        db.commit()
+        return combinations
+    
+    async def _schedule_combinations(self, writer: _GenerationWriter, combinations: List,
+                                     report_progress):
+        """Reuse existing combinations and cached responses, and schedule the rest.
+        
+        Cached responses are buffered in the writer. The remaining combinations
+        run concurrently, routed through provider batch APIs in batch mode.
+        Returns whether each combination was reused, the batch jobs, and one
+        awaitable per combination not reused, in combination order.
+        """
+        experiment = writer.experiment
+        
+        # Look up cached responses for every new combination in one query
+        cached_responses = {}
+        keys = [key for *_, key, existing in combinations if key]
+        if keys and not experiment.bypass_cache:
+            cached_responses = {
+                cached.hash: cached
+                for cached in await writer.db.scalars(
+                    select(LLMResponseCache).where(LLMResponseCache.hash.in_(keys))
+                )
+            }
+        
+        reused = []
+        pending = []
+        batch_requests = {}
         
-        return generations
+        for provider, model, strategy, task_id, prompt, key, existing in combinations:
+            if not existing and key in cached_responses:
+                writer.add(self._cached_row(
+                    experiment.id, task_id, provider, model, PromptStrategy(strategy),
+                    prompt, cached_responses[key]
+                ))
+                existing = True
+            
+            reused.append(existing)
+            if existing:
+                report_progress()
+            elif experiment.batch_mode and provider in BATCH_PROVIDERS and prompt is not None:
+                future = asyncio.get_running_loop().create_future()
+                batch_requests.setdefault(provider, []).append((future, model, strategy, task_id, prompt))
+                pending.append(future)
+            else:
+                pending.append(self._generate_combination(
+                    writer, report_progress, provider, model, strategy, task_id, prompt
+                ))
+        
+        batch_jobs = [
+            self._run_batch(writer, provider, requests, report_progress)
+            for provider, requests in batch_requests.items()
+        ]
+        return reused, batch_jobs, pending
     
-    def get_generation_progress(self, db: Session, experiment_id: int) -> Dict:
+    async def _generate_combination(self, writer: _GenerationWriter, report_progress,
+                                    provider: str, model: str, strategy: str,
+                                    task_id: str, prompt: Optional[str]) -> Dict:
+        """Generate and save one combination within its provider's limits"""
+        try:
+            if prompt is None:
+                raise ValueError(f"Task {task_id} not found")
+            
+            async with self._semaphores[provider], self._rate_limiters[provider]:
+                row = await self._build_generation(
+                    writer.experiment.id, task_id, provider, model, PromptStrategy(strategy), prompt
+                )
+            await writer.save([row])
+            return row
+        finally:
+            report_progress()
+    
+    async def _cache_new_responses(self, db: AsyncSession, experiment: Experiment,
+                                   combinations: List, reused: List[bool],
+                                   results: List) -> None:
+        """Report failed combinations and cache the responses of successful ones"""
+        results = iter(results)
+        new_responses = {}
+        
+        for (provider, model, strategy, task_id, prompt, key, _), existing in zip(combinations, reused):
+            if existing:
+                continue
+            
+            result = next(results)
+            if isinstance(result, Exception):
+                print(f"Error generating {provider}/{model}/{strategy}/{task_id}: {result}")
+            elif result["generated_content"]:
+                new_responses[key] = self._cache_entry(key, result)
+        
+        # Cache the new responses separately, so a concurrent run caching the
+        # same call cannot roll back the generations
+        if new_responses and not experiment.bypass_cache:
+            try:
+                db.add_all(new_responses.values())
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    async def get_generation_progress(self, db: AsyncSession, experiment_id: int) -> Dict:
         """Get progress of generations for an experiment"""
         
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+        # Completed and failed counts, as subqueries correlated to the
+        # experiment so they are fetched in the same query as its status
+        completed = select(func.count(Generation.id)).where(
+            Generation.experiment_id == Experiment.id
+        ).scalar_subquery()
+        failed = select(
+            func.coalesce(func.sum(case((Generation.generated_content == "", 1), else_=0)), 0)
+        ).where(
+            Generation.experiment_id == Experiment.id
+        ).scalar_subquery()
+        
+        experiment = (await db.execute(
+            select(
+                Experiment.status,
+                Experiment.total_combinations,
+                completed.label("completed"),
+                failed.label("failed")
+            ).where(Experiment.id == experiment_id)
+        )).first()
         if not experiment:
             return {"error": "Experiment not found"}
         
-        total_expected = (len(experiment.selected_models) * 
-                         len(experiment.selected_strategies) * 
-                         len(experiment.selected_tasks))
-        
-        completed = db.query(Generation).filter(
-            Generation.experiment_id == experiment_id
-        ).count()
+        total_expected = experiment.total_combinations
+        if total_expected is None:
+            # Experiments created before the total was stored
+            selected = (await db.execute(
+                select(
+                    Experiment.selected_models,
+                    Experiment.selected_strategies,
+                    Experiment.selected_tasks
+                ).where(Experiment.id == experiment_id)
+            )).one()
+            total_expected = (len(selected.selected_models) * 
+                             len(selected.selected_strategies) * 
+                             len(selected.selected_tasks))
         
-        failed = db.query(Generation).filter(
-            Generation.experiment_id == experiment_id,
-            Generation.generated_content == ""
-        ).count()
+        completed, failed = experiment.completed, experiment.failed
         
         return {
             "experiment_id": experiment_id,
@@ -1,24 +1,71 @@
+import asyncio
+import hashlib
+import json
 import os
 import time
-from typing import Dict, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import openai
 import anthropic
 import google.generativeai as genai
-from config import PRICING, MODELS
+from google.api_core import exceptions as google_exceptions
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from config import PRICING
+
+# Providers whose batch APIs can run a whole experiment asynchronously
+BATCH_PROVIDERS = ("openai", "anthropic")
+
+# Batch API requests are billed at half the synchronous price
+BATCH_COST_FACTOR = 0.5
+
+# Attempts per provider call, including the first one
+MAX_ATTEMPTS = 5
+
+RATE_LIMIT_ERRORS = (
+    openai.RateLimitError,
+    anthropic.RateLimitError,
+    google_exceptions.ResourceExhausted
+)
+
+# Connection failures and 5xx responses worth retrying, besides rate limits
+TRANSIENT_ERRORS = RATE_LIMIT_ERRORS + (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    anthropic.APIConnectionError,
+    anthropic.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError
+)
+
+_wait_rate_limited = wait_random_exponential(min=1, max=60)
+_wait_transient = wait_random_exponential(min=0.5, max=8)
+
+def _backoff(retry_state) -> float:
+    """Back off longer after rate limits than after network errors"""
+    if isinstance(retry_state.outcome.exception(), RATE_LIMIT_ERRORS):
+        return _wait_rate_limited(retry_state)
+    return _wait_transient(retry_state)
+
+def response_cache_key(provider: str, model: str, prompt: str, params: Dict) -> str:
+    """Hash identifying a provider call, for reusing its cached response"""
+    key = f"{provider}|{model}|{prompt}|{json.dumps(params, sort_keys=True)}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
 
 class LLMClient:
     def __init__(self):
+        # SDK retries are disabled so the tenacity policy in _retrying is the
+        # only retry layer, and retry counts cover every request made
+        
         # Initialize OpenAI client
         openai_key = os.getenv("OPENAI_API_KEY")
         if openai_key:
-            self.openai_client = openai.OpenAI(api_key=openai_key)
+            self.openai_client = openai.AsyncOpenAI(api_key=openai_key, max_retries=0)
         else:
             self.openai_client = None
             
         # Initialize Anthropic client
         anthropic_key = os.getenv("ANTHROPIC_API_KEY")
         if anthropic_key:
-            self.anthropic_client = anthropic.Anthropic(api_key=anthropic_key)
+            self.anthropic_client = anthropic.AsyncAnthropic(api_key=anthropic_key, max_retries=0)
         else:
             self.anthropic_client = None
             
@@ -28,29 +75,47 @@ class LLMClient:
             genai.configure(api_key=google_key)
         else:
             print("Warning: Google API key not found")
+        
+        # Gemini model objects, built once per model name
+        self._google_models: Dict[str, genai.GenerativeModel] = {}
     
-    def generate(self, 
+    def _google_model(self, model: str) -> genai.GenerativeModel:
+        """Return the cached GenerativeModel for a Gemini model name"""
+        model_obj = self._google_models.get(model)
+        if model_obj is None:
+            model_obj = self._google_models[model] = genai.GenerativeModel(model)
+        return model_obj
+    
+    async def generate(self, 
                  provider: str, 
                  model: str, 
                  prompt: str, 
-                 params: Optional[Dict] = None) -> Tuple[str, Dict]:
+                 params: Dict) -> Tuple[str, Dict]:
         """
         Generate content using specified LLM provider and model.
         
         Returns: (generated_content, metadata)
-        metadata includes: latency_ms, prompt_tokens, completion_tokens, cost_usd
+        metadata includes: latency_ms, prompt_tokens, completion_tokens, cost_usd, retries
         """
-        if params is None:
-            params = MODELS[provider]["params"]
-            
+        retrying = self._retrying()
+        
+        # Latency covers only the latest attempt, leaving out failed attempts
+        # and backoff waits, which retry_count records instead
         start_time = time.time()
         
+        async def attempt(call, *args, **kwargs):
+            nonlocal start_time
+            start_time = time.time()
+            return await call(*args, **kwargs)
+        
         try:
             if provider == "openai":
                 if not self.openai_client:
                     raise ValueError("OpenAI API key not configured")
                     
-                response = self.openai_client.chat.completions.create(
+                response = await retrying(
+                    attempt,
+                    self.openai_client.chat.completions.create,
                     model=model,
                     messages=[{"role": "user", "content": prompt}],
                     temperature=params.get("temperature", 0.7),
@@ -73,7 +138,9 @@ class LLMClient:
                 if not self.anthropic_client:
                     raise ValueError("Anthropic API key not configured")
                     
-                response = self.anthropic_client.messages.create(
+                response = await retrying(
+                    attempt,
+                    self.anthropic_client.messages.create,
                     model=model,
                     messages=[{"role": "user", "content": prompt}],
                     temperature=params.get("temperature", 0.7),
@@ -93,8 +160,10 @@ class LLMClient:
                 }
                 
             elif provider == "google":
-                model_obj = genai.GenerativeModel(model)
-                response = model_obj.generate_content(
+                model_obj = self._google_model(model)
+                response = await retrying(
+                    attempt,
+                    model_obj.generate_content_async,
                     prompt,
                     generation_config=genai.GenerationConfig(
                         temperature=params.get("temperature", 0.7),
@@ -103,14 +172,20 @@ class LLMClient:
                 )
                 
                 content = response.text
+                latency_ms = (time.time() - start_time) * 1000
                 
-                # For Gemini, we'll estimate tokens based on character count
-                # Rough estimate: 1 token ≈ 4 characters
-                prompt_tokens = len(prompt) // 4
-                completion_tokens = len(content) // 4
+                # Use the billed token counts Gemini reports, counting the
+                # prompt separately only if the response carries none
+                usage = getattr(response, "usage_metadata", None)
+                if usage and usage.prompt_token_count:
+                    prompt_tokens = usage.prompt_token_count
+                    completion_tokens = usage.candidates_token_count
+                else:
+                    prompt_tokens = (await model_obj.count_tokens_async(prompt)).total_tokens
+                    completion_tokens = (await model_obj.count_tokens_async(content)).total_tokens
                 
                 metadata = {
-                    "latency_ms": (time.time() - start_time) * 1000,
+                    "latency_ms": latency_ms,
                     "prompt_tokens": prompt_tokens,
                     "completion_tokens": completion_tokens,
                     "cost_usd": self._calculate_cost(
@@ -121,7 +196,8 @@ class LLMClient:
                 }
             else:
                 raise ValueError(f"Unknown provider: {provider}")
-                
+            
+            metadata["retries"] = self._retry_count(retrying)
             return content, metadata
             
         except Exception as e:
@@ -131,9 +207,181 @@ class LLMClient:
                 "latency_ms": (time.time() - start_time) * 1000,
                 "prompt_tokens": 0,
                 "completion_tokens": 0,
-                "cost_usd": 0
+                "cost_usd": 0,
+                "retries": self._retry_count(retrying)
             }
     
+    def _retrying(self) -> AsyncRetrying:
+        """Retry policy for a single provider call"""
+        return AsyncRetrying(
+            retry=retry_if_exception_type(TRANSIENT_ERRORS),
+            wait=_backoff,
+            stop=stop_after_attempt(MAX_ATTEMPTS),
+            reraise=True
+        )
+    
+    def _retry_count(self, retrying: AsyncRetrying) -> int:
+        """Number of retries made so far by a retry policy"""
+        return retrying.statistics.get("attempt_number", 1) - 1
+    
+    async def submit_batch(self, provider: str, requests: List[Dict]) -> str:
+        """
+        Submit prompts to a provider's batch API.
+        
+        Each request has: custom_id, model, prompt, params
+        Returns: the provider's batch ID
+        """
+        if provider == "openai":
+            if not self.openai_client:
+                raise ValueError("OpenAI API key not configured")
+            
+            lines = [
+                json.dumps({
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": request["model"],
+                        "messages": [{"role": "user", "content": request["prompt"]}],
+                        "temperature": request["params"].get("temperature", 0.7),
+                        "max_tokens": request["params"].get("max_tokens", 500)
+                    }
+                })
+                for request in requests
+            ]
+            
+            batch_file = await self.openai_client.files.create(
+                file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = await self.openai_client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            return batch.id
+        
+        elif provider == "anthropic":
+            if not self.anthropic_client:
+                raise ValueError("Anthropic API key not configured")
+            
+            batch = await self.anthropic_client.messages.batches.create(
+                requests=[
+                    {
+                        "custom_id": request["custom_id"],
+                        "params": {
+                            "model": request["model"],
+                            "messages": [{"role": "user", "content": request["prompt"]}],
+                            "temperature": request["params"].get("temperature", 0.7),
+                            "max_tokens": request["params"].get("max_tokens", 500)
+                        }
+                    }
+                    for request in requests
+                ]
+            )
+            return batch.id
+        
+        raise ValueError(f"Batch API not supported for provider: {provider}")
+    
+    async def poll_batch(self, provider: str, batch_id: str,
+                         requests: List[Dict]) -> Optional[Dict[str, Tuple[str, Dict]]]:
+        """
+        Check a batch submitted with submit_batch once.
+        
+        Returns: None while the batch is still running, otherwise
+        {custom_id: (generated_content, metadata)} for every request. Results
+        for custom_ids not among the requests are skipped.
+        """
+        models = {request["custom_id"]: request["model"] for request in requests}
+        results = {}
+        
+        if provider == "openai":
+            batch = await self.openai_client.batches.retrieve(batch_id)
+            if batch.status not in ("completed", "failed", "expired", "cancelled"):
+                return None
+            
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                
+                batch_file = await self.openai_client.files.content(file_id)
+                for line in batch_file.text.splitlines():
+                    if not line.strip():
+                        continue
+                    
+                    entry = json.loads(line)
+                    if entry["custom_id"] not in models:
+                        continue
+                    response = entry.get("response") or {}
+                    body = response.get("body") or {}
+                    
+                    if response.get("status_code") == 200:
+                        usage = body["usage"]
+                        results[entry["custom_id"]] = (
+                            body["choices"][0]["message"]["content"],
+                            self._batch_metadata(
+                                provider, models[entry["custom_id"]], batch_id,
+                                usage["prompt_tokens"], usage["completion_tokens"]
+                            )
+                        )
+                    else:
+                        error = entry.get("error") or body.get("error") or {}
+                        results[entry["custom_id"]] = (None, self._batch_error(
+                            batch_id, error.get("message", f"Batch {batch.status}")
+                        ))
+        
+        elif provider == "anthropic":
+            batch = await self.anthropic_client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended":
+                return None
+            
+            async for entry in await self.anthropic_client.messages.batches.results(batch_id):
+                if entry.custom_id not in models:
+                    continue
+                if entry.result.type == "succeeded":
+                    message = entry.result.message
+                    results[entry.custom_id] = (
+                        message.content[0].text,
+                        self._batch_metadata(
+                            provider, models[entry.custom_id], batch_id,
+                            message.usage.input_tokens, message.usage.output_tokens
+                        )
+                    )
+                else:
+                    error = getattr(entry.result, "error", None)
+                    results[entry.custom_id] = (None, self._batch_error(
+                        batch_id, str(error) if error else entry.result.type
+                    ))
+        
+        else:
+            raise ValueError(f"Batch API not supported for provider: {provider}")
+        
+        return results
+    
+    def _batch_metadata(self, provider: str, model: str, batch_id: str,
+                        prompt_tokens: int, completion_tokens: int) -> Dict:
+        """Metadata for a successful batch result, priced at the batch rate"""
+        return {
+            "latency_ms": None,  # Batch requests have no per-request latency
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": round(
+                self._calculate_cost(provider, model, prompt_tokens, completion_tokens) * BATCH_COST_FACTOR, 6
+            ),
+            "batch_id": batch_id
+        }
+    
+    def _batch_error(self, batch_id: str, error: str) -> Dict:
+        """Metadata for a failed batch result"""
+        return {
+            "error": error,
+            "latency_ms": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0,
+            "batch_id": batch_id
+        }
+    
     def _calculate_cost(self, provider: str, model: str, 
                        prompt_tokens: int, completion_tokens: int) -> float:
         """Calculate cost based on token usage and pricing"""
@@ -146,44 +394,43 @@ class LLMClient:
             print(f"Warning: Pricing not found for {provider}/{model}")
             return 0.0
     
-    def test_connection(self) -> Dict[str, bool]:
-        """Test connections to all configured LLM providers"""
+    async def test_connection(self) -> Dict[str, bool]:
+        """Test connections to all configured LLM providers in parallel"""
+        probes = {
+            "openai": self._probe_openai(),
+            "anthropic": self._probe_anthropic(),
+            "google": self._probe_google()
+        }
+        outcomes = await asyncio.gather(*probes.values(), return_exceptions=True)
+        
         results = {}
+        for provider, outcome in zip(probes, outcomes):
+            if isinstance(outcome, Exception):
+                results[provider] = False
+                print(f"{provider.capitalize()} connection failed: {outcome}")
+            else:
+                results[provider] = outcome
         
-        # Test OpenAI
-        if self.openai_client:
-            try:
-                self.openai_client.models.list()
-                results["openai"] = True
-            except Exception as e:
-                results["openai"] = False
-                print(f"OpenAI connection failed: {e}")
-        else:
-            results["openai"] = False
-            
-        # Test Anthropic
-        if self.anthropic_client:
-            try:
-                # Simple test with minimal tokens
-                self.anthropic_client.messages.create(
-                    model="claude-3-haiku-20240307",
-                    messages=[{"role": "user", "content": "Hi"}],
-                    max_tokens=1
-                )
-                results["anthropic"] = True
-            except Exception as e:
-                results["anthropic"] = False
-                print(f"Anthropic connection failed: {e}")
-        else:
-            results["anthropic"] = False
-            
-        # Test Google
-        try:
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            model.generate_content("Hi", generation_config=genai.GenerationConfig(max_output_tokens=1))
-            results["google"] = True
-        except Exception as e:
-            results["google"] = False
-            print(f"Google connection failed: {e}")
-            
-        return results
\ No newline at end of file
+        return results
+    
+    async def _probe_openai(self) -> bool:
+        if not self.openai_client:
+            return False
+        await self.openai_client.models.list()
+        return True
+    
+    async def _probe_anthropic(self) -> bool:
+        if not self.anthropic_client:
+            return False
+        # Simple test with minimal tokens
+        await self.anthropic_client.messages.create(
+            model="claude-3-haiku-20240307",
+            messages=[{"role": "user", "content": "Hi"}],
+            max_tokens=1
+        )
+        return True
+    
+    async def _probe_google(self) -> bool:
+        model = self._google_model("gemini-1.5-flash")
+        await model.generate_content_async("Hi", generation_config=genai.GenerationConfig(max_output_tokens=1))
+        return True
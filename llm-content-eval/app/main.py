@@ -4,9 +4,11 @@ from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import os
 
-from app.database import init_db, load_tasks
+from app.database import async_engine, init_db, load_tasks
+from app.pagination import NEXT_CURSOR_HEADER
 from app.routers import experiments, generations, evaluations, analysis
 from config import APP_TITLE, APP_VERSION, DEBUG_MODE
 
@@ -18,10 +20,17 @@ async def lifespan(app: FastAPI):
     init_db()
     print("Loading tasks...")
     load_tasks()
+    app.state.generation_queue = asyncio.Queue()
+    app.state.queued_experiments = set()  # IDs queued or running, so each runs once at a time
+    generation_workers = generations.start_generation_workers(
+        app.state.generation_queue, app.state.queued_experiments
+    )
     print("Application started successfully!")
     yield
     # Shutdown
     print("Application shutting down...")
+    await generations.stop_generation_workers(generation_workers)
+    await async_engine.dispose()
 
 # Create FastAPI app
 app = FastAPI(
@@ -38,6 +47,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Mount static files
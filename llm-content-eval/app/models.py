@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Boolean, Index, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -30,11 +30,20 @@ class Experiment(Base):
     selected_models = Column(JSON)  # List of selected model configs
     selected_strategies = Column(JSON)  # List of selected strategies
     selected_tasks = Column(JSON)  # List of selected task IDs
+    total_combinations = Column(Integer)  # models x strategies x tasks, set at creation
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="setup")  # setup, generating, evaluating, complete
+    batch_mode = Column(Boolean, default=False)  # Generate through provider batch APIs
+    batch_ids = Column(JSON)  # Provider -> submitted batch ID whose results are not saved yet
+    bypass_cache = Column(Boolean, default=False)  # Always call the providers, ignoring cached responses
     
     generations = relationship("Generation", back_populates="experiment")
     evaluations = relationship("Evaluation", back_populates="experiment")
+    
+    __table_args__ = (
+        # Newest-first keyset pagination of the experiment list
+        Index("ix_exp_created_id", "created_at", "id"),
+    )
 
 class Task(Base):
     __tablename__ = "tasks"
@@ -65,10 +74,21 @@ class Generation(Base):
     prompt_tokens = Column(Integer)
     completion_tokens = Column(Integer)
     cost_usd = Column(Float)
+    retry_count = Column(Integer, default=0)  # Provider call retries after transient errors
+    pending_blind_id = Column(String(8), index=True, unique=True)  # Blind ID handed out, awaiting evaluation
     
     experiment = relationship("Experiment", back_populates="generations")
     task = relationship("Task", back_populates="generations")
     evaluation = relationship("Evaluation", uselist=False, back_populates="generation")
+    
+    __table_args__ = (
+        # Serves the per-experiment GROUP BYs in analysis (model / strategy)
+        Index("ix_gen_exp_prov_model_strat", "experiment_id", "model_provider", "model_name", "prompt_strategy"),
+        # One generation per combination, also serving point lookups of one
+        Index("ix_gen_lookup", "experiment_id", "task_id", "model_provider", "model_name", "prompt_strategy", unique=True),
+        # Keyset pagination of an experiment's generations and lookups by ID within one
+        Index("ix_gen_exp_id", "experiment_id", "id"),
+    )
 
 class Evaluation(Base):
     __tablename__ = "evaluations"
@@ -78,6 +98,13 @@ class Evaluation(Base):
     experiment_id = Column(Integer, ForeignKey("experiments.id"))
     blind_id = Column(String)  # Random ID for blind evaluation
     
+    # Copied from the generation at submit time so analysis can group
+    # evaluations without joining generations
+    task_id = Column(String, ForeignKey("tasks.id"))
+    model_provider = Column(SQLEnum(ModelProvider))
+    model_name = Column(String)
+    prompt_strategy = Column(SQLEnum(PromptStrategy))
+    
     # Scores (1-5 scale)
     voice_match = Column(Integer)
     coherence = Column(Integer)
@@ -94,4 +121,22 @@ class Evaluation(Base):
     evaluation_time_seconds = Column(Integer)
     
     generation = relationship("Generation", back_populates="evaluation")
-    experiment = relationship("Experiment", back_populates="evaluations")
\ No newline at end of file
+    experiment = relationship("Experiment", back_populates="evaluations")
+    
+    __table_args__ = (
+        # Lets best/worst lookups walk the index instead of sorting
+        Index("ix_eval_exp_quality", "experiment_id", "overall_quality"),
+        # Backs the generation -> evaluation anti-join when picking blind items
+        Index("ix_eval_generation_id", "generation_id"),
+        # Serve the per-experiment strategy and task GROUP BYs in analysis
+        Index("ix_eval_exp_strategy", "experiment_id", "prompt_strategy"),
+        Index("ix_eval_exp_task", "experiment_id", "task_id"),
+    )
+
+class LLMResponseCache(Base):
+    __tablename__ = "llm_response_cache"
+    
+    hash = Column(String(32), primary_key=True)  # blake2b of provider, model, prompt and params
+    content = Column(Text)
+    response_metadata = Column("metadata", JSON)  # latency_ms, tokens and cost of the original call
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,37 @@
+import base64
+import json
+from typing import Any, Callable, List
+from fastapi import Response
+
+# Page size used when a request gives no limit, and the largest one accepted
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Response header carrying the cursor of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the sort key of a page's last row as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decode a cursor back into the sort key it was built from"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def paginate(rows: List, limit: int, response: Response,
+             sort_key: Callable[[Any], List[Any]]) -> List:
+    """Trim a page fetched with limit + 1 rows and set the next-page cursor.
+
+    The extra row only shows that another page exists; the cursor points
+    just past the last row returned.
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(sort_key(rows[-1]))
+    return rows
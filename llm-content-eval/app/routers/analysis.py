@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 from app.database import get_db
@@ -42,12 +42,11 @@ def get_heatmap_data(experiment_id: int, db: Session = Depends(get_db)):
     data = analysis_service.get_heatmap_data(db, experiment_id)
     return data
 
-@router.get("/{experiment_id}/export", response_class=PlainTextResponse)
+@router.get("/{experiment_id}/export", response_class=StreamingResponse)
 def export_to_csv(experiment_id: int, db: Session = Depends(get_db)):
     """Export all evaluation data as CSV"""
-    csv_data = analysis_service.export_to_csv(db, experiment_id)
-    return PlainTextResponse(
-        content=csv_data,
+    return StreamingResponse(
+        analysis_service.export_to_csv(db, experiment_id),
         media_type="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename=experiment_{experiment_id}_results.csv"
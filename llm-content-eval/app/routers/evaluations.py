@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import time
@@ -41,9 +42,9 @@ def get_evaluation_progress(experiment_id: int, db: Session = Depends(get_db)):
     return progress
 
 @router.post("/skip/{blind_id}")
-def skip_blind_item(blind_id: str):
-    """Skip a blind item (remove from cache)"""
-    success = evaluation_service.skip_blind_item(blind_id)
+def skip_blind_item(blind_id: str, db: Session = Depends(get_db)):
+    """Skip a blind item (release its blind ID)"""
+    success = evaluation_service.skip_blind_item(db, blind_id)
     if not success:
         raise HTTPException(status_code=404, detail="Blind item not found")
     return {"message": "Item skipped"}
@@ -51,8 +52,10 @@ def skip_blind_item(blind_id: str):
 @router.get("/{experiment_id}", response_model=List[EvaluationResponse])
 def get_evaluations(experiment_id: int, db: Session = Depends(get_db)):
     """Get all evaluations for an experiment"""
-    evaluations = evaluation_service.get_all_evaluations(db, experiment_id)
-    return evaluations
+    return StreamingResponse(
+        evaluation_service.stream_all_evaluations(db, experiment_id),
+        media_type="application/json"
+    )
 
 @router.get("/reveal/{blind_id}")
 def reveal_generation_details(blind_id: str, db: Session = Depends(get_db)):
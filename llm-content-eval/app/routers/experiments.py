@@ -1,30 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
-from app.models import Experiment, Task
-from app.schemas import ExperimentCreate, ExperimentResponse, TaskResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
+from typing import List, Optional
+from datetime import datetime
+import hashlib
+from app.database import get_async_db, get_db
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate
+from app.models import Evaluation, Experiment, Generation, Task
+from app.analysis_service import invalidate_analysis_cache
+from app.evaluation_service import invalidate_progress_cache
+from app.schemas import ExperimentCreate, ExperimentResponse, ExperimentSummary, TaskResponse
 
 router = APIRouter(prefix="/api/experiments", tags=["experiments"])
 
+# Seconds clients may reuse a task list page without revalidating it
+TASKS_MAX_AGE_SECONDS = 60
+
 @router.post("/", response_model=ExperimentResponse)
 def create_experiment(experiment: ExperimentCreate, db: Session = Depends(get_db)):
     """Create a new experiment"""
     
-    # Validate that tasks exist
-    for task_id in experiment.selected_tasks:
-        task = db.query(Task).filter(Task.id == task_id).first()
-        if not task:
-            raise HTTPException(status_code=400, detail=f"Task {task_id} not found")
+    # Validate that tasks exist, in a single query
+    requested = set(experiment.selected_tasks)
+    found = {task_id for task_id, in db.query(Task.id).filter(Task.id.in_(requested))}
+    missing = requested - found
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Tasks not found: {sorted(missing)}")
     
     # Create experiment
     db_experiment = Experiment(
         name=experiment.name,
         description=experiment.description,
         baseline_samples=experiment.baseline_samples,
-        selected_models=experiment.selected_models,
-        selected_strategies=experiment.selected_strategies,
+        selected_models=[model.model_dump() for model in experiment.selected_models],
+        selected_strategies=[strategy.value for strategy in experiment.selected_strategies],
         selected_tasks=experiment.selected_tasks,
+        total_combinations=(len(experiment.selected_models) *
+                            len(experiment.selected_strategies) *
+                            len(experiment.selected_tasks)),
+        batch_mode=experiment.batch_mode,
+        bypass_cache=experiment.bypass_cache,
         status="setup"
     )
     
@@ -34,16 +50,42 @@ def create_experiment(experiment: ExperimentCreate, db: Session = Depends(get_db
     
     return db_experiment
 
-@router.get("/", response_model=List[ExperimentResponse])
-def list_experiments(db: Session = Depends(get_db)):
-    """List all experiments"""
-    experiments = db.query(Experiment).order_by(Experiment.created_at.desc()).all()
-    return experiments
+@router.get("/", response_model=List[ExperimentSummary])
+async def list_experiments(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List experiments, newest first, one page at a time"""
+    # Skip the JSON columns, which only the detail view needs
+    query = select(Experiment).options(load_only(
+        Experiment.id,
+        Experiment.name,
+        Experiment.description,
+        Experiment.created_at,
+        Experiment.status
+    )).order_by(Experiment.created_at.desc(), Experiment.id.desc())
+    
+    if cursor:
+        # Continue after the (created_at, id) of the previous page's last row
+        try:
+            created_at, experiment_id = decode_cursor(cursor)
+            created_at = datetime.fromisoformat(created_at)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(
+            tuple_(Experiment.created_at, Experiment.id) < (created_at, experiment_id)
+        )
+    
+    experiments = await db.scalars(query.limit(limit + 1))
+    return paginate(experiments.all(), limit, response,
+                    lambda experiment: [experiment.created_at.isoformat(), experiment.id])
 
 @router.get("/{experiment_id}", response_model=ExperimentResponse)
-def get_experiment(experiment_id: int, db: Session = Depends(get_db)):
+async def get_experiment(experiment_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get experiment details"""
-    experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
+    experiment = await db.get(Experiment, experiment_id)
     if not experiment:
         raise HTTPException(status_code=404, detail="Experiment not found")
     return experiment
@@ -51,15 +93,16 @@ def get_experiment(experiment_id: int, db: Session = Depends(get_db)):
 @router.put("/{experiment_id}/status")
 def update_experiment_status(experiment_id: int, status: str, db: Session = Depends(get_db)):
     """Update experiment status"""
-    experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
-    if not experiment:
-        raise HTTPException(status_code=404, detail="Experiment not found")
-    
     valid_statuses = ["setup", "generating", "evaluating", "complete"]
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
     
-    experiment.status = status
+    # Update in place, without loading the experiment first
+    updated = db.query(Experiment).filter(
+        Experiment.id == experiment_id
+    ).update({Experiment.status: status}, synchronize_session=False)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Experiment not found")
     db.commit()
     
     return {"message": f"Status updated to {status}"}
@@ -67,17 +110,55 @@ def update_experiment_status(experiment_id: int, status: str, db: Session = Depe
 @router.delete("/{experiment_id}")
 def delete_experiment(experiment_id: int, db: Session = Depends(get_db)):
     """Delete an experiment and all related data"""
-    experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
-    if not experiment:
+    # Delete rows before the rows their foreign keys reference: evaluations,
+    # then generations, then the experiment itself
+    db.query(Evaluation).filter(
+        Evaluation.experiment_id == experiment_id
+    ).delete(synchronize_session=False)
+    db.query(Generation).filter(
+        Generation.experiment_id == experiment_id
+    ).delete(synchronize_session=False)
+    deleted = db.query(Experiment).filter(
+        Experiment.id == experiment_id
+    ).delete(synchronize_session=False)
+    if not deleted:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Experiment not found")
-    
-    db.delete(experiment)
     db.commit()
     
+    # Bulk deletes skip the ORM events that keep these caches fresh
+    invalidate_analysis_cache(experiment_id)
+    invalidate_progress_cache(experiment_id)
+    
     return {"message": "Experiment deleted successfully"}
 
 @router.get("/tasks/all", response_model=List[TaskResponse])
-def list_tasks(db: Session = Depends(get_db)):
-    """List all available tasks"""
-    tasks = db.query(Task).all()
-    return tasks
\ No newline at end of file
+async def list_tasks(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List available tasks by ID, one page at a time"""
+    # Tasks are only written when the catalog is loaded, so their count and
+    # highest ID identify it; the page parameters pick the slice
+    count, last_id = (await db.execute(select(func.count(Task.id), func.max(Task.id)))).one()
+    etag = 'W/"' + hashlib.md5(f"{count}:{last_id}:{limit}:{cursor}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TASKS_MAX_AGE_SECONDS}"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    
+    query = select(Task).order_by(Task.id)
+    
+    if cursor:
+        try:
+            task_id, = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Task.id > task_id)
+    
+    tasks = await db.scalars(query.limit(limit + 1))
+    return paginate(tasks.all(), limit, response, lambda task: [task.id])
\ No newline at end of file
@@ -1,106 +1,190 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Set, Union
+from app.database import AsyncSessionLocal, get_async_db
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate
 from app.models import Generation, PromptStrategy
-from app.schemas import GenerationRequest, GenerationProgress, GenerationResponse
-from app.generation_service import GenerationService
+from app.schemas import GenerationRequest, GenerationProgress, GenerationResponse, GenerationListItem
+from app.generation_service import GenerationService, GenerationInProgressError
 import asyncio
+import orjson
+from cachetools import TTLCache
 
 router = APIRouter(prefix="/api/generations", tags=["generations"])
 generation_service = GenerationService()
 
+# Seconds a provider connection test result is reused before probing again
+CONNECTION_TEST_TTL_SECONDS = 60
+
+# Maps provider to whether it connected, shared by every test-llm request
+_connection_results = TTLCache(maxsize=8, ttl=CONNECTION_TEST_TTL_SECONDS)
+_connection_lock = asyncio.Lock()
+
+# Characters of generated content included in a generation list preview
+GENERATION_PREVIEW_LENGTH = 200
+
+# Columns selected for generation lists, matching GenerationResponse for full
+# lists and GenerationListItem for previews
+GENERATION_RESPONSE_COLUMNS = [getattr(Generation, name) for name in GenerationResponse.model_fields]
+GENERATION_PREVIEW_COLUMNS = [
+    getattr(Generation, name) for name in GenerationListItem.model_fields if name != "preview"
+] + [func.substr(Generation.generated_content, 1, GENERATION_PREVIEW_LENGTH).label("preview")]
+
+# Number of experiments generated at once by the background workers
+GENERATION_WORKERS = 4
+
 @router.post("/start")
 async def start_generation(
     request: GenerationRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Start generation process for an experiment"""
     
     if request.run_all:
-        # Run all generations in background
-        background_tasks.add_task(
-            run_all_generations,
-            db,
-            request.experiment_id
-        )
+        # Queue the experiment for the background generation workers, once
+        # until its run finishes
+        queued_experiments = http_request.app.state.queued_experiments
+        if request.experiment_id in queued_experiments:
+            return {"message": "Generation already running", "experiment_id": request.experiment_id}
+        queued_experiments.add(request.experiment_id)
+        await http_request.app.state.generation_queue.put(request.experiment_id)
         return {"message": "Generation started in background", "experiment_id": request.experiment_id}
     else:
         # Generate specific combination
         if not request.specific_combination:
             raise HTTPException(status_code=400, detail="specific_combination required when run_all is False")
         
-        generation = await generation_service.generate_single(
-            db,
-            request.experiment_id,
-            request.specific_combination["task_id"],
-            request.specific_combination["provider"],
-            request.specific_combination["model"],
-            PromptStrategy(request.specific_combination["strategy"])
-        )
+        combination = request.specific_combination
+        try:
+            generation = await generation_service.generate_single(
+                db,
+                request.experiment_id,
+                combination.task_id,
+                combination.provider,
+                combination.model,
+                combination.strategy
+            )
+        except GenerationInProgressError as e:
+            raise HTTPException(status_code=409, detail=str(e))
         
         return {"message": "Generation completed", "generation_id": generation.id}
 
-async def run_all_generations(db: Session, experiment_id: int):
-    """Background task to run all generations"""
+async def run_all_generations(experiment_id: int):
+    """Run all generations for an experiment in its own session"""
     try:
-        await generation_service.generate_all_for_experiment(db, experiment_id)
+        async with AsyncSessionLocal() as db:
+            await generation_service.generate_all_for_experiment(db, experiment_id)
     except Exception as e:
         print(f"Error in background generation: {e}")
 
+async def generation_worker(queue: asyncio.Queue, queued_experiments: Set[int]):
+    """Run queued experiments one at a time until cancelled"""
+    while True:
+        experiment_id = await queue.get()
+        try:
+            await run_all_generations(experiment_id)
+        finally:
+            queued_experiments.discard(experiment_id)
+            queue.task_done()
+
+def start_generation_workers(queue: asyncio.Queue, queued_experiments: Set[int]) -> List[asyncio.Task]:
+    """Start the workers that consume the generation queue"""
+    return [
+        asyncio.create_task(generation_worker(queue, queued_experiments))
+        for _ in range(GENERATION_WORKERS)
+    ]
+
+async def stop_generation_workers(workers: List[asyncio.Task]):
+    """Cancel the generation workers and wait for them to finish"""
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
 @router.get("/progress/{experiment_id}", response_model=GenerationProgress)
-def get_generation_progress(experiment_id: int, db: Session = Depends(get_db)):
+async def get_generation_progress(experiment_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get generation progress for an experiment"""
-    progress = generation_service.get_generation_progress(db, experiment_id)
+    progress = await generation_service.get_generation_progress(db, experiment_id)
     if "error" in progress:
         raise HTTPException(status_code=404, detail=progress["error"])
     return progress
 
-@router.post("/single")
+@router.post("/single", response_model=GenerationResponse)
 async def generate_single(
     experiment_id: int,
     task_id: str,
     provider: str,
     model: str,
-    strategy: str,
-    db: Session = Depends(get_db)
+    strategy: PromptStrategy,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate a single combination"""
     try:
         generation = await generation_service.generate_single(
-            db, experiment_id, task_id, provider, model, PromptStrategy(strategy)
+            db, experiment_id, task_id, provider, model, strategy
         )
-        return GenerationResponse.from_orm(generation)
+        return generation
+    except GenerationInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{experiment_id}", response_model=List[GenerationResponse])
-def get_generations(experiment_id: int, db: Session = Depends(get_db)):
-    """Get all generations for an experiment"""
-    generations = db.query(Generation).filter(
+@router.get("/{experiment_id}", response_model=Union[List[GenerationListItem], List[GenerationResponse]])
+async def get_generations(
+    experiment_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    full: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get an experiment's generations by ID, one page at a time.
+    
+    Each generation carries a short preview of its content unless full is set.
+    """
+    columns = GENERATION_RESPONSE_COLUMNS if full else GENERATION_PREVIEW_COLUMNS
+    query = select(*columns).where(
         Generation.experiment_id == experiment_id
-    ).all()
-    return generations
+    ).order_by(Generation.id)
+    
+    if cursor:
+        try:
+            generation_id, = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Generation.id > generation_id)
+    
+    rows = (await db.execute(query.limit(limit + 1))).mappings().all()
+    page = paginate(rows, limit, response, lambda row: [row["id"]])
+    
+    # Rows come straight from the database, so serialize them with orjson
+    # instead of validating each one against the response schema
+    return Response(
+        content=orjson.dumps([dict(row) for row in page]),
+        media_type="application/json",
+        headers=dict(response.headers)
+    )
 
 @router.get("/{experiment_id}/{generation_id}", response_model=GenerationResponse)
-def get_generation(experiment_id: int, generation_id: int, db: Session = Depends(get_db)):
+async def get_generation(experiment_id: int, generation_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a specific generation"""
-    generation = db.query(Generation).filter(
-        Generation.id == generation_id,
-        Generation.experiment_id == experiment_id
-    ).first()
+    generation = await db.get(Generation, generation_id)
     
-    if not generation:
+    if not generation or generation.experiment_id != experiment_id:
         raise HTTPException(status_code=404, detail="Generation not found")
     
     return generation
 
 @router.post("/test-llm")
-def test_llm_connections():
+async def test_llm_connections():
     """Test connections to all LLM providers"""
-    service = GenerationService()
-    results = service.llm_client.test_connection()
+    # Concurrent requests wait for a single probe and share its results
+    async with _connection_lock:
+        if not _connection_results:
+            # Reuse the service's clients and their open connections
+            _connection_results.update(await generation_service.llm_client.test_connection())
+        results = dict(_connection_results)
     return {
         "connections": results,
         "summary": f"{sum(results.values())}/{len(results)} providers connected"
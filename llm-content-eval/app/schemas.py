@@ -1,34 +1,58 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Dict, Optional, Any
 from datetime import datetime
 from app.models import ModelProvider, ContentType, PromptStrategy
 
+class ModelSpec(BaseModel):
+    provider: str
+    model: str
+
 class ExperimentCreate(BaseModel):
     name: str
     description: Optional[str] = None
     baseline_samples: List[str]
-    selected_models: List[Dict[str, str]]  # [{"provider": "openai", "model": "gpt-4"}]
-    selected_strategies: List[str]
+    selected_models: List[ModelSpec]  # [{"provider": "openai", "model": "gpt-4"}]
+    selected_strategies: List[PromptStrategy]
     selected_tasks: List[str]
+    batch_mode: bool = False
+    bypass_cache: bool = False
 
 class ExperimentResponse(BaseModel):
     id: int
     name: str
     description: Optional[str]
     baseline_samples: List[str]
-    selected_models: List[Dict[str, str]]
+    selected_models: List[ModelSpec]
     selected_strategies: List[str]
     selected_tasks: List[str]
     created_at: datetime
     status: str
+    batch_mode: Optional[bool] = False
+    batch_ids: Optional[Dict[str, str]] = None
+    bypass_cache: Optional[bool] = False
+    
+    model_config = ConfigDict(from_attributes=True)
+
+class ExperimentSummary(BaseModel):
+    """Columns shown in the experiment list"""
+    id: int
+    name: str
+    description: Optional[str]
+    created_at: datetime
+    status: str
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class SpecificCombination(BaseModel):
+    task_id: str
+    provider: str
+    model: str
+    strategy: PromptStrategy
 
 class GenerationRequest(BaseModel):
     experiment_id: int
     run_all: bool = False
-    specific_combination: Optional[Dict] = None
+    specific_combination: Optional[SpecificCombination] = None
 
 class GenerationProgress(BaseModel):
     experiment_id: int
@@ -63,8 +87,7 @@ class TaskResponse(BaseModel):
     structured_prompt: str
     example_prompt_template: str
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class GenerationResponse(BaseModel):
     id: int
@@ -73,13 +96,25 @@ class GenerationResponse(BaseModel):
     model_provider: ModelProvider
     model_name: str
     prompt_strategy: PromptStrategy
-    generated_content: str
+    generated_content: Optional[str]  # None while the generation is in progress
     timestamp: datetime
-    latency_ms: float
+    latency_ms: Optional[float]  # None for batch API generations
     cost_usd: float
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class GenerationListItem(BaseModel):
+    """Generation in a list, with the start of its content instead of all of it"""
+    id: int
+    experiment_id: int
+    task_id: str
+    model_provider: ModelProvider
+    model_name: str
+    prompt_strategy: PromptStrategy
+    preview: Optional[str]  # None while the generation is in progress
+    timestamp: datetime
+    latency_ms: Optional[float]
+    cost_usd: float
 
 class EvaluationResponse(BaseModel):
     id: int
@@ -95,8 +130,7 @@ class EvaluationResponse(BaseModel):
     notes: Optional[str]
     evaluated_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class AnalysisSummary(BaseModel):
     experiment_id: int
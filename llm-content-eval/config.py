@@ -33,6 +33,25 @@ MODELS = {
     }
 }
 
+# Per-provider request limits: concurrent in-flight calls and requests per minute
+PROVIDER_LIMITS = {
+    "openai": {
+        "concurrency": 10,
+        "rpm": 500
+    },
+    "anthropic": {
+        "concurrency": 5,
+        "rpm": 50
+    },
+    "google": {
+        "concurrency": 5,
+        "rpm": 60
+    }
+}
+
+# Seconds between status checks of a submitted provider batch
+BATCH_POLL_INTERVAL_SECONDS = 60
+
 # Pricing per 1K tokens (update with current pricing)
 PRICING = {
     "openai": {
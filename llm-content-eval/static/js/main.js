@@ -26,6 +26,27 @@ async function fetchAPI(endpoint, options = {}) {
     }
 }
 
+// Fetch every page of a paginated list endpoint, following the
+// X-Next-Cursor header until the last page
+async function fetchAllPages(endpoint) {
+    const items = [];
+    let cursor = null;
+    
+    do {
+        const separator = endpoint.includes('?') ? '&' : '?';
+        const url = cursor ? `${endpoint}${separator}cursor=${encodeURIComponent(cursor)}` : endpoint;
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error('API request failed');
+        }
+        
+        items.push(...await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+    
+    return items;
+}
+
 // Format date
 function formatDate(dateString) {
     const date = new Date(dateString);